@@ -0,0 +1,296 @@
+"""Benchmarks for the insert, search, statistics and achievement paths.
+
+Builds a synthetic logbook of each requested size in a temporary database,
+times the operations the app performs and writes the results as JSON, so
+two versions can be compared:
+
+    python benchmarks/bench.py --sizes 10k,100k --output new.json
+    python benchmarks/bench.py compare old.json new.json
+
+Sizes accept k and M suffixes; the default is 10k,100k,1M, and 10M can be
+added with --sizes. Timings are in milliseconds; peak memory is the Python
+heap high-water mark while the operation runs, as measured by tracemalloc.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trainspotter import achievements  # noqa: E402
+from trainspotter.database import LEADERBOARDS, Database  # noqa: E402
+
+# (class, first unit number, fleet size, relative frequency). Busy freight
+# and multiple-unit classes turn up far more often than heritage traction
+CLASSES = [
+    ("66", 66001, 480, 30),
+    ("158", 158701, 170, 18),
+    ("150", 150001, 130, 12),
+    ("43", 43002, 190, 8),
+    ("800", 800001, 110, 10),
+    ("390", 390001, 57, 6),
+    ("70", 70001, 37, 3),
+    ("37", 37025, 60, 2),
+    ("08", 8401, 100, 2),
+    ("55", 55001, 22, 1),
+]
+
+STATIONS = [
+    "Crewe", "York", "Doncaster", "Peterborough", "Derby", "Carlisle",
+    "Preston", "Warrington Bank Quay", "Newcastle", "Bristol Temple Meads",
+    "Reading", "Birmingham New Street", "Leeds", "Stafford", "Tamworth",
+    "Nuneaton", "Didcot Parkway", "Edinburgh Waverley", "Clapham Junction",
+    "Ely",
+]
+
+# Share of sightings with each flag set
+SPECIAL_LIVERY_RATE = 0.05
+RARE_RATE = 0.02
+DRIVER_INTERACTION_RATE = 0.03
+
+DEFAULT_SIZES = "10k,100k,1M"
+SAMPLES = 200
+GENERATE_BATCH = 100000
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    multiplier = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+
+def generate(count, seed=0):
+    # Yield (DateTime, Station, Class, Number, SpecialLivery, Rare,
+    # DriverInteraction) rows. Stations follow a Zipf-like distribution and
+    # within a class a few units are seen much more often than the rest
+    rng = random.Random(seed)
+    class_weights = [weight for _, _, _, weight in CLASSES]
+    station_weights = [1 / rank for rank in range(1, len(STATIONS) + 1)]
+    start = int(time.time()) - 5 * 365 * 86400
+
+    for i in range(count):
+        train_class, first, fleet, _ = rng.choices(CLASSES, class_weights)[0]
+        unit = int(rng.paretovariate(1.2)) - 1
+        if unit >= fleet:
+            unit = rng.randrange(fleet)
+        yield (
+            start + i * 60,
+            rng.choices(STATIONS, station_weights)[0],
+            train_class,
+            str(first + unit),
+            rng.random() < SPECIAL_LIVERY_RATE,
+            rng.random() < RARE_RATE,
+            rng.random() < DRIVER_INTERACTION_RATE,
+        )
+
+
+def populate(db, count, seed=0):
+    rows = generate(count, seed)
+    remaining = count
+    while remaining:
+        batch = min(remaining, GENERATE_BATCH)
+        db.insert_logs(next(rows) for _ in range(batch))
+        remaining -= batch
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(func, samples):
+    # Time func once per sample and report latency, throughput and peak memory
+    timings = []
+    tracemalloc.start()
+    started = time.perf_counter()
+    for i in range(samples):
+        before = time.perf_counter()
+        func(i)
+        timings.append((time.perf_counter() - before) * 1000)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "samples": samples,
+        "p50_ms": round(percentile(timings, 0.50), 4),
+        "p99_ms": round(percentile(timings, 0.99), 4),
+        "ops_per_sec": round(samples / elapsed, 1) if elapsed else None,
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def bench_size(size, samples, seed):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, "bench.db"))
+        db.create_tables()
+
+        started = time.perf_counter()
+        populate(db, size, seed)
+        load_seconds = time.perf_counter() - started
+        results["bulk_load"] = {
+            "rows": size,
+            "seconds": round(load_seconds, 3),
+            "rows_per_sec": round(size / load_seconds, 1),
+        }
+
+        rng = random.Random(seed + 1)
+        sightings = list(generate(samples, seed + 2))
+        classes = [rng.choices(CLASSES, [w for _, _, _, w in CLASSES])[0][0] for _ in range(samples)]
+
+        def insert(i):
+            db.insert_log(*sightings[i][1:])
+
+        def search_first_page(i):
+            # Make the cached pages stale so every sample reads the database
+            db.search_cache.bump()
+            db.search_logs(classes[i], None, None, False)
+
+        def search_flags(i):
+            db.search_cache.bump()
+            db.search_logs(classes[i], i % 2 == 0 or None, i % 3 == 0 or None, False)
+
+        def search_cached(i):
+            db.search_logs(classes[i], None, None, False)
+
+        def statistics(i):
+            # Drop the cached snapshot so every sample reads the database
+            db.statistics = None
+            db.fetch_statistics()
+
+        def statistics_cached(i):
+            db.fetch_statistics()
+
+        def leaderboards(i):
+            for board in LEADERBOARDS:
+                db.leaderboard(board)
+
+        def evaluate_achievements(i):
+            with db.lock:
+                achievements.evaluate(db._achievement_snapshot(db.conn.cursor()))
+
+        def unlocked_achievements(i):
+            db.fetch_unlocked_achievements()
+
+        operations = [
+            ("insert_log", insert),
+            ("search_first_page", search_first_page),
+            ("search_flags", search_flags),
+            ("search_cached", search_cached),
+            ("statistics", statistics),
+            ("statistics_cached", statistics_cached),
+            ("leaderboards", leaderboards),
+            ("evaluate_achievements", evaluate_achievements),
+            ("unlocked_achievements", unlocked_achievements),
+        ]
+        for name, func in operations:
+            results[name] = measure(func, samples)
+
+        # Walking every page of the busiest class shows the cost of a large result set
+        def search_all(i):
+            db.search_cache.bump()
+            last_id = 0
+            while True:
+                page = db.search_logs(CLASSES[0][0], None, None, False, after_id=last_id)
+                if not page:
+                    break
+                last_id = page[-1][6]
+
+        results["search_all_pages"] = measure(search_all, 3)
+
+        db.close()
+        results["file_bytes"] = os.path.getsize(os.path.join(directory, "bench.db"))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "samples": args.samples,
+        "sizes": {},
+    }
+    for size in [parse_size(size) for size in args.sizes.split(",")]:
+        print(f"Benchmarking {size} sightings...", file=sys.stderr)
+        report["sizes"][str(size)] = bench_size(size, args.samples, args.seed)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+def compare(args):
+    # Report every operation whose p50 or p99 got slower by more than the threshold
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    regressions = 0
+    for size, operations in new["sizes"].items():
+        for name, result in operations.items():
+            previous = old["sizes"].get(size, {}).get(name)
+            if not isinstance(result, dict) or not isinstance(previous, dict):
+                continue
+            for metric in ("p50_ms", "p99_ms"):
+                if metric not in result or not previous.get(metric):
+                    continue
+                ratio = result[metric] / previous[metric]
+                marker = ""
+                if ratio > args.threshold:
+                    marker = "  REGRESSION"
+                    regressions += 1
+                print(f"{size:>10} {name:<24} {metric:<7} {previous[metric]:>10.3f} -> {result[metric]:>10.3f}  x{ratio:.2f}{marker}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train Spotter benchmarks")
+    commands = parser.add_subparsers(dest="command")
+
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated sizes (default: %(default)s)")
+    parser.add_argument("--samples", type=int, default=SAMPLES, help="samples per operation (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=1.2,
+                                help="slow-down ratio reported as a regression (default: %(default)s)")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
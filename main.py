@@ -1,123 +1,219 @@
+import os
+import time
+
+# Taken before Kivy is imported, so the startup trace includes loading it
+STARTED = time.perf_counter()
+
 from kivy.app import App
+from kivy.clock import Clock
+from kivy.logger import Logger
 from kivy.uix.gridlayout import GridLayout
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.scrollview import ScrollView
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.uix.label import Label
 from kivy.uix.image import Image
 from kivy.uix.checkbox import CheckBox
 from kivy.uix.button import Button
-from kivy.utils import get_color_from_hex
+from kivy.uix.popup import Popup
+from kivy.utils import get_color_from_hex, platform
 from kivy.uix.screenmanager import ScreenManager, Screen
 from kivy.uix.textinput import TextInput
-import sqlite3
+
+from trainspotter import Database, Worker
+from trainspotter.achievements import describe_unlock
+from trainspotter.database import SEARCH_PAGE_SIZE
+from trainspotter.journal import SightingQueue
+from trainspotter.roster import format_progress, load_roster_file, reload_rosters
+from trainspotter.statistics import (
+    BREAKDOWN_LABELS, LEADERBOARD_LABELS, PERIOD_LABELS, describe_breakdown, describe_leaderboard,
+    describe as describe_statistics,
+)
+
+
+class StartupTrace:
+    # Milliseconds from STARTED to each step of startup, logged once the
+    # first frame is on screen
+    def __init__(self):
+        self.marks = []
+
+    def mark(self, step):
+        self.marks.append((step, (time.perf_counter() - STARTED) * 1000))
+
+    def report(self):
+        Logger.info("Startup: " + ", ".join(f"{step} {ms:.0f} ms" for step, ms in self.marks))
+
+
+class LazyScreenManager(ScreenManager):
+    # Screens are registered with a factory and only built the first time
+    # they are asked for, whether by get_screen or by setting current
+    def __init__(self, **kwargs):
+        super(LazyScreenManager, self).__init__(**kwargs)
+        self.factories = {}
+
+    def register(self, name, factory):
+        self.factories[name] = factory
+
+    def get_screen(self, name):
+        if not self.has_screen(name) and name in self.factories:
+            self.add_widget(self.factories[name](name=name))
+        return super(LazyScreenManager, self).get_screen(name)
 
 
 class TrainSpotter(App):
     def build(self):
-        self.create_tables()  # Create the required tables in the SQLite database
-        sm = ScreenManager()
-        sm.add_widget(Log1(name='station'))
-        sm.add_widget(Log2(name='type'))
-        sm.add_widget(Log3(name='exact'))
-        sm.add_widget(Log4(name='confirm'))
-        sm.add_widget(Home(name='home'))
-        sm.add_widget(Search(name='search'))
-        sm.add_widget(SearchResults(name='search_results'))
-        sm.add_widget(Achievements(name='achievements'))
-        sm.add_widget(Statistics(name='statistics'))
+        self.trace = StartupTrace()
+        self.trace.mark('build')
+        self.db = Database()
+        # Database work runs on a background thread; results come back to
+        # the UI thread through the Kivy clock
+        self.worker = Worker(dispatch=lambda func: Clock.schedule_once(lambda dt: func()))
+        self.create_tables()  # Create or upgrade the tables, unless they are up to date
+        self.trace.mark('database')
+
+        # Sightings from rapid-entry mode that weren't saved before the app
+        # last closed are saved now
+        self.queue = SightingQueue()
+        self.flush_job = None
+        self.flush_queue()
+
+        # Roster files the user has loaded are loaded again in the
+        # background if they have changed since
+        self.worker.submit(reload_rosters, self.db, error_callback=self.on_roster_failed)
+
+        # Only the home screen is built before the first frame
+        sm = LazyScreenManager()
+        sm.register('station', Log1)
+        sm.register('type', Log2)
+        sm.register('exact', Log3)
+        sm.register('confirm', Log4)
+        sm.register('home', Home)
+        sm.register('search', Search)
+        sm.register('search_results', SearchResults)
+        sm.register('achievements', Achievements)
+        sm.register('statistics', Statistics)
+        sm.register('leaderboards', Leaderboards)
+        sm.register('breakdown', Breakdown)
+        sm.register('rapid', RapidLog)
         sm.current = 'home'
+        self.trace.mark('home screen')
         return sm
 
-    
+    def on_start(self):
+        # on_flip fires once a frame has been drawn
+        from kivy.core.window import Window
+        Window.bind(on_flip=self.on_first_frame)
+
+    def on_first_frame(self, window):
+        window.unbind(on_flip=self.on_first_frame)
+        self.trace.mark('first frame')
+        self.trace.report()
+
+    def on_stop(self):
+        # The worker saves the queue before it stops; the journal is trimmed
+        # on the next start if the callback doesn't get to run
+        self.flush_queue()
+        self.worker.stop()
+        self.queue.close()
+        Logger.info("Search cache: " + ", ".join(f"{name} {value}" for name, value in self.db.search_cache.stats().items()))
+        self.db.close()
+
+    def on_pause(self):
+        # Android may kill a paused app without calling on_stop
+        self.flush_queue()
+        return True
+
     def create_tables(self):
-        conn = sqlite3.connect("tp.db")
-        cursor = conn.cursor()
-
-        # Create the FullLog table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS FullLog (
-                ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                DateTime TEXT,
-                Station TEXT,
-                Class TEXT,
-                Number TEXT,
-                SpecialLivery TEXT,
-                Rare TEXT,
-                DriverInteraction TEXT
-            )
-        """)
-
-        # Create the Basic table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS Basic (
-                ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                Class TEXT,
-                Number TEXT,
-                Quantity INTEGER
+        # Create or upgrade the database on the worker. Jobs submitted in the
+        # meantime queue up behind it, so no screen sees a half-upgraded
+        # database; a long upgrade shows its progress in a popup
+        if not self.db.needs_migration():
+            return
+        self.migration_popup = None
+        self.worker.submit(self.run_migrations, callback=self.on_migrated, error_callback=self.on_migration_failed)
+
+    def run_migrations(self):
+        # Runs on the worker thread
+        for description, done, total in self.db.migrate():
+            if total:
+                self.worker.dispatch(lambda description=description, done=done, total=total:
+                                     self.show_migration_progress(description, done, total))
+
+    def show_migration_progress(self, description, done, total):
+        self.open_migration_popup()
+        self.migration_label.text = f"{description}\n{done * 100 // total}%"
+
+    def open_migration_popup(self):
+        if self.migration_popup is None:
+            self.migration_label = Label(text='', font_size=24)
+            self.migration_popup = Popup(
+                title="Upgrading your logbook",
+                content=self.migration_label,
+                size_hint=(0.8, 0.4),
+                auto_dismiss=False
             )
-        """)
-
-        # Create the Total table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS Total (
-                ID INTEGER PRIMARY KEY,
-                SpecialLivery INTEGER,
-                Rare INTEGER,
-                DriverInteraction INTEGER
-            )
-        """)
-
-        # Insert an initial row into the Total table
-        cursor.execute("""
-            INSERT OR IGNORE INTO Total (ID, SpecialLivery, Rare, DriverInteraction)
-            VALUES (1, 0, 0, 0)
-        """)
+            self.migration_popup.open()
+
+    def on_migrated(self, result):
+        if self.migration_popup is not None:
+            self.migration_popup.dismiss()
+            self.migration_popup = None
+
+    def on_migration_failed(self, error):
+        # Leave the message up; the upgrade carries on from where it stopped
+        # the next time the app starts
+        self.open_migration_popup()
+        self.migration_label.text = f"Upgrading the logbook failed:\n{error}"
+        self.migration_popup.auto_dismiss = True
+
+    def on_roster_failed(self, error):
+        Logger.warning(f"Roster: could not reload a roster file: {error}")
+
+    def insert_log(self, station, train_class, train_number, special_livery, rare, driver_interaction, callback=None):
+        return self.worker.submit(
+            self.db.insert_log,
+            station, train_class, train_number, special_livery, rare, driver_interaction,
+            callback=callback
+        )
 
-        conn.commit()
-        conn.close()
+    def flush_queue(self, callback=None):
+        # Save the rapid-entry queue in one transaction, one batch at a time
+        if self.flush_job is not None or not self.queue.pending:
+            return
+        batch = self.queue.batch()
+        self.flush_job = self.worker.submit(
+            self.queue.write, self.db, batch,
+            callback=lambda result: self.on_queue_flushed(batch[-1][0], result, callback),
+            error_callback=self.on_queue_flush_failed
+        )
 
-    def insert_log(self, station, train_class, train_number, special_livery, rare, driver_interaction):
-        conn = sqlite3.connect("tp.db")
-        cursor = conn.cursor()
-
-        # Insert into FullLog table
-        cursor.execute("""
-            INSERT INTO FullLog ( Station, Class, Number, SpecialLivery, Rare, DriverInteraction)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (station, train_class, train_number, special_livery, rare, driver_interaction))
-
-        # Check if there is a matching entry in the Basic table
-        cursor.execute("""
-            SELECT Quantity FROM Basic
-            WHERE Class = ? AND Number = ?
-        """, (train_class, train_number))
-        result = cursor.fetchone()
-
-        if result is None:
-            # No matching entry found, insert a new row with quantity 1
-            cursor.execute("""
-                INSERT INTO Basic (Class, Number, Quantity)
-                VALUES (?, ?, 1)
-            """, (train_class, train_number))
-        else:
-            # Matching entry found, update the quantity by incrementing it by 1
-            quantity = result[0] + 1
-            cursor.execute("""
-                UPDATE Basic SET Quantity = ?
-                WHERE Class = ? AND Number = ?
-            """, (quantity, train_class, train_number))
-
-        # Update the Total table
-        cursor.execute("""
-            UPDATE Total SET
-            SpecialLivery = (SELECT COUNT(*) FROM FullLog WHERE SpecialLivery = 'Yes'),
-            Rare = (SELECT COUNT(*) FROM FullLog WHERE Rare = 'Yes'),
-            DriverInteraction = (SELECT COUNT(*) FROM FullLog WHERE DriverInteraction = 'Yes')
-            WHERE ID = 1
-        """)
-
-        conn.commit()
-        conn.close()
+    def on_queue_flushed(self, sequence, result, callback):
+        self.flush_job = None
+        self.queue.confirm(sequence)
+        count, unlocked, cops = result
+        self.show_unlocks((unlocked, cops))
+        if callback is not None:
+            callback(count)
+
+    def on_queue_flush_failed(self, error):
+        # The sightings stay queued and journaled until the next flush
+        self.flush_job = None
+
+    def show_unlocks(self, result):
+        # Let the user know about any achievement a sighting unlocked, and
+        # any unit on the roster seen for the first time. result is the
+        # (titles, new cops) of an insert
+        titles, cops = result
+        for popup_title, lines in (("Achievement Unlocked!", titles), ("New Cop!", cops)):
+            if not lines:
+                continue
+            popup = Popup(
+                title=popup_title,
+                content=Label(text="\n".join(lines), font_size=30),
+                size_hint=(0.8, 0.4)
+            )
+            popup.open()
 
 
 class Home(Screen):
@@ -182,6 +278,16 @@ class Home(Screen):
         self.stsbtn.bind(on_press=self.goto_statistics)
         self.window.add_widget(self.stsbtn)
 
+        self.rapidbtn = Button(
+            text="Rapid Log",
+            font_size=60,
+            size_hint=(0.75, 0.3),
+            background_color=get_color_from_hex('#ff5aa4'),
+            background_normal=""
+        )
+        self.rapidbtn.bind(on_press=self.goto_rapid)
+        self.window.add_widget(self.rapidbtn)
+
         self.add_widget(self.window)
 
         # Initialize attributes to store entered values
@@ -219,49 +325,13 @@ class Home(Screen):
     def goto_statistics(self, instance):
         self.manager.current = 'statistics'
 
+    def goto_rapid(self, instance):
+        self.manager.current = 'rapid'
+
     def insert_log(self, station, train_class, train_number, special_livery, rare, driver_interaction):
-        # Insert the log into the database or perform any other required operations
-        conn = sqlite3.connect("tp.db")
-        cursor = conn.cursor()
-
-        # Insert into FullLog table
-        cursor.execute("""
-            INSERT INTO FullLog (Station, Class, Number, SpecialLivery, Rare, DriverInteraction)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (station, train_class, train_number, special_livery, rare, driver_interaction))
-
-        # Check if there is a matching entry in the Basic table
-        cursor.execute("""
-            SELECT Quantity FROM Basic
-            WHERE Class = ? AND Number = ?
-        """, (train_class, train_number))
-        result = cursor.fetchone()
-
-        if result is None:
-            # No matching entry found, insert a new row with quantity 1
-            cursor.execute("""
-                INSERT INTO Basic (Class, Number, Quantity)
-                VALUES (?, ?, 1)
-            """, (train_class, train_number))
-        else:
-            # Matching entry found, update the quantity by incrementing it by 1
-            quantity = result[0] + 1
-            cursor.execute("""
-                UPDATE Basic SET Quantity = ?
-                WHERE Class = ? AND Number = ?
-            """, (quantity, train_class, train_number))
-
-        # Update the Total table
-        cursor.execute("""
-            UPDATE Total SET
-            SpecialLivery = (SELECT COUNT(*) FROM FullLog WHERE SpecialLivery = 'Yes'),
-            Rare = (SELECT COUNT(*) FROM FullLog WHERE Rare = 'Yes'),
-            DriverInteraction = (SELECT COUNT(*) FROM FullLog WHERE DriverInteraction = 'Yes')
-            WHERE ID = 1
-        """)
-
-        conn.commit()
-        conn.close()
+        # Insert the log into the database through the app so there is a single write path
+        app = App.get_running_app()
+        app.insert_log(station, train_class, train_number, special_livery, rare, driver_interaction)
 
 class Log1(Screen):
     def __init__(self, **kwargs):
@@ -490,17 +560,145 @@ class Log4(Screen):
         station = home_screen.station_text
         train_class = home_screen.type_text
         train_number = home_screen.exact_text
-        special_livery = home_screen.sl
-        rare = home_screen.rare
-        driver_interaction = home_screen.di
+        special_livery = home_screen.sl == "Yes"
+        rare = home_screen.rare == "Yes"
+        driver_interaction = home_screen.di == "Yes"
 
-        # Insert the log into the database
+        # Insert the log into the database in the background
         app = App.get_running_app()
-        app.insert_log(station, train_class, train_number, special_livery, rare, driver_interaction)
+        app.insert_log(station, train_class, train_number, special_livery, rare, driver_interaction, callback=app.show_unlocks)
 
         self.manager.current = "home"
 
 
+class RapidLog(Screen):
+    # Rapid-entry mode for busy stations. The station and class stay filled
+    # in between sightings; each sighting is queued and journaled straight
+    # away, and the queue is saved every FLUSH_INTERVAL seconds, when the
+    # user leaves the screen or on demand
+    FLUSH_INTERVAL = 30
+
+    def __init__(self, **kwargs):
+        super(RapidLog, self).__init__(**kwargs)
+        self.window = GridLayout()
+        self.window.cols = 1
+        self.window.size_hint = (0.6, 0.9)
+        self.window.pos_hint = {"center_x": 0.5, "center_y": 0.5}
+        self.window.spacing = [1, 10]
+
+        self.station_label = Label(text="Station", font_size=30)
+        self.station = TextInput(multiline=False, font_size=30)
+        self.class_label = Label(text="Train Class", font_size=30)
+        self.train_class = TextInput(multiline=False, font_size=30, input_type=("number"))
+        self.number_label = Label(text="Train Number", font_size=30)
+        self.number = TextInput(multiline=False, font_size=30, input_type=("number"))
+        self.number.bind(on_text_validate=self.add_sighting)
+
+        layout = BoxLayout(orientation='horizontal')
+        self.special_livery_checkbox = CheckBox(active=False)
+        layout.add_widget(Label(text="Special Livery"))
+        layout.add_widget(self.special_livery_checkbox)
+        self.rare_checkbox = CheckBox(active=False)
+        layout.add_widget(Label(text="Rare"))
+        layout.add_widget(self.rare_checkbox)
+        self.driver_interaction_checkbox = CheckBox(active=False)
+        layout.add_widget(Label(text="Driver Interaction"))
+        layout.add_widget(self.driver_interaction_checkbox)
+
+        self.add_button = Button(text="Add Sighting", font_size=40, background_color=get_color_from_hex('#ff5aa4'))
+        self.add_button.bind(on_press=self.add_sighting)
+
+        self.pending_label = Label(text="", font_size=24)
+
+        self.save_button = Button(text="Save Now", font_size=30, background_color=get_color_from_hex('#8cc63e'))
+        self.save_button.bind(on_press=self.save)
+
+        self.back_button = Button(text="Back", font_size=30, background_color=get_color_from_hex('#ff0000'))
+        self.back_button.bind(on_press=self.go_back)
+
+        self.window.add_widget(self.station_label)
+        self.window.add_widget(self.station)
+        self.window.add_widget(self.class_label)
+        self.window.add_widget(self.train_class)
+        self.window.add_widget(self.number_label)
+        self.window.add_widget(self.number)
+        self.window.add_widget(layout)
+        self.window.add_widget(self.add_button)
+        self.window.add_widget(self.pending_label)
+        self.window.add_widget(self.save_button)
+        self.window.add_widget(self.back_button)
+        self.add_widget(self.window)
+
+        self.flush_event = None
+
+    def on_enter(self):
+        # Start from the station of the last trip logged
+        if not self.station.text:
+            self.station.text = self.manager.get_screen('home').station_text
+        self.flush_event = Clock.schedule_interval(lambda dt: self.save(None), self.FLUSH_INTERVAL)
+        self.update_pending()
+
+    def on_leave(self):
+        if self.flush_event is not None:
+            self.flush_event.cancel()
+            self.flush_event = None
+        self.save(None)
+
+    def add_sighting(self, instance):
+        if not self.train_class.text or not self.number.text:
+            return
+        app = App.get_running_app()
+        app.queue.add(
+            self.station.text,
+            self.train_class.text,
+            self.number.text,
+            self.special_livery_checkbox.active,
+            self.rare_checkbox.active,
+            self.driver_interaction_checkbox.active
+        )
+
+        # Ready for the next train at the same station
+        self.number.text = ''
+        self.special_livery_checkbox.active = False
+        self.rare_checkbox.active = False
+        self.driver_interaction_checkbox.active = False
+        self.number.focus = True
+        self.update_pending()
+
+    def save(self, instance):
+        App.get_running_app().flush_queue(callback=self.on_saved)
+
+    def on_saved(self, count):
+        self.update_pending()
+        if count:
+            self.pending_label.text += f"\n(saved {count})"
+
+    def update_pending(self):
+        self.pending_label.text = f"{len(App.get_running_app().queue.pending)} waiting to be saved"
+
+    def go_back(self, instance):
+        self.manager.current = 'home'
+
+
+class FlagChoice(Button):
+    # A search filter that cycles through Any, Yes and No when pressed; its
+    # value is None, True or False to match
+    CHOICES = ((None, "Any"), (True, "Yes"), (False, "No"))
+
+    def __init__(self, **kwargs):
+        super(FlagChoice, self).__init__(**kwargs)
+        self.index = 0
+        self.text = self.CHOICES[0][1]
+
+    @property
+    def value(self):
+        return self.CHOICES[self.index][0]
+
+    def on_press(self):
+        self.index = (self.index + 1) % len(self.CHOICES)
+        self.text = self.CHOICES[self.index][1]
+
+
 class Search(Screen):
     def __init__(self, **kwargs):
         super(Search, self).__init__(**kwargs)
@@ -510,19 +708,19 @@ class Search(Screen):
         self.window.pos_hint = {"center_x": 0.5, "center_y": 0.5}
         self.window.spacing = 1
 
-        self.search_label = Label(text="Search by Train Class:", font_size=30)
+        self.search_label = Label(text="Search by Train Class (e.g. 66, 70):", font_size=30)
         self.train_class_input = TextInput(multiline=False, font_size=30)
 
-        self.search_livery_checkbox = CheckBox(active=False)
-        self.search_livery_checkbox.bind(active=self.set_search_livery)
+        self.keyword_label = Label(text="Station or Number:", font_size=30)
+        self.keyword_input = TextInput(multiline=False, font_size=30)
+
+        self.search_livery_choice = FlagChoice(font_size=30)
         self.search_livery_label = Label(text="Has Special Livery", font_size=30)
 
-        self.search_rare_checkbox = CheckBox(active=False)
-        self.search_rare_checkbox.bind(active=self.set_search_rare)
+        self.search_rare_choice = FlagChoice(font_size=30)
         self.search_rare_label = Label(text="Is Rare", font_size=30)
 
-        self.search_interaction_checkbox = CheckBox(active=False)
-        self.search_interaction_checkbox.bind(active=self.set_search_interaction)
+        self.search_interaction_choice = FlagChoice(font_size=30)
         self.search_interaction_label = Label(text="Has Driver Interaction", font_size=30)
 
         self.search_button = Button(text="Search", font_size=30, background_color=get_color_from_hex('#ffa500'))
@@ -533,69 +731,29 @@ class Search(Screen):
 
         self.window.add_widget(self.search_label)
         self.window.add_widget(self.train_class_input)
+        self.window.add_widget(self.keyword_label)
+        self.window.add_widget(self.keyword_input)
         self.window.add_widget(self.search_livery_label)
-        self.window.add_widget(self.search_livery_checkbox)
+        self.window.add_widget(self.search_livery_choice)
         self.window.add_widget(self.search_rare_label)
-        self.window.add_widget(self.search_rare_checkbox)
+        self.window.add_widget(self.search_rare_choice)
         self.window.add_widget(self.search_interaction_label)
-        self.window.add_widget(self.search_interaction_checkbox)
+        self.window.add_widget(self.search_interaction_choice)
         self.window.add_widget(self.search_button)
         self.window.add_widget(self.back_button)
 
         self.add_widget(self.window)
 
-    def set_search_livery(self, instance, value):
-        self.search_livery = value
-
-    def set_search_rare(self, instance, value):
-        self.search_rare = value
-
-    def set_search_interaction(self, instance, value):
-        self.search_interaction = value
-
     def search_logs(self, instance):
         train_class = self.train_class_input.text
-        has_livery = self.search_livery_checkbox.active
-        is_rare = self.search_rare_checkbox.active
-        has_interaction = self.search_interaction_checkbox.active
-
-        # Perform the search using the provided filters
-        conn = sqlite3.connect("tp.db")
-        cursor = conn.cursor()
-
-        # Construct the SQL query with dynamic conditions based on the checkbox status
-        query_conditions = []
-        params = []
-
-        query_conditions.append("(Class = ? AND DriverInteraction = ?)")
-        params.extend([train_class, "Yes" if has_interaction else "No"])
-
-        if has_livery and is_rare:
-            query_conditions.append("(Class = ? AND SpecialLivery = ? AND Rare = ?)")
-            params.extend([train_class, "Yes", "Yes"])
-        elif has_livery:
-            query_conditions.append("(Class = ? AND SpecialLivery = ?)")
-            params.extend([train_class, "Yes"])
-        elif is_rare:
-            query_conditions.append("(Class = ? AND Rare = ?)")
-            params.extend([train_class, "Yes"])
-
-        # Combine the conditions using AND operator to create the final query
-        query = """
-            SELECT Station, Class, Number, SpecialLivery, Rare, DriverInteraction
-            FROM FullLog
-        """
-
-        if query_conditions:
-            query += " WHERE " + " AND ".join(query_conditions)
-
-        cursor.execute(query, tuple(params))
-        results = cursor.fetchall()
-        conn.close()
-
-        # Display the search results
+        has_livery = self.search_livery_choice.value
+        is_rare = self.search_rare_choice.value
+        has_interaction = self.search_interaction_choice.value
+        keywords = self.keyword_input.text.strip()
+
+        # Display the search results; the results screen fetches them a page at a time
         search_results_screen = self.manager.get_screen('search_results')
-        search_results_screen.on_results_text(results)
+        search_results_screen.start_search((train_class, has_livery, is_rare, has_interaction), keywords)
         self.manager.current = 'search_results'
 
 
@@ -605,23 +763,47 @@ class Search(Screen):
 
 
 
+class ResultRow(Label):
+    # One search result. The RecycleView reuses a handful of these for the
+    # rows currently on screen and only swaps their text as it scrolls
+    def __init__(self, **kwargs):
+        super(ResultRow, self).__init__(**kwargs)
+        self.font_size = 20
+        self.halign = 'left'
+        self.valign = 'middle'
+        self.bind(size=self.setter('text_size'))
+
+
 class SearchResults(Screen):
     def __init__(self, **kwargs):
         super(SearchResults, self).__init__(**kwargs)
         self.layout = BoxLayout(orientation='vertical')
 
-        # Create the ScrollView and GridLayout
-        self.scrollview = ScrollView()
-        self.grid_layout = GridLayout(cols=1, spacing=10, size_hint_y=None)
+        self.count_label = Label(text='', font_size=20, size_hint=(1, 0.08))
+        self.layout.add_widget(self.count_label)
+
+        # Create the RecycleView, which only builds widgets for the visible rows
+        self.recycleview = RecycleView()
+        self.recycleview.viewclass = ResultRow
+        self.results_layout = RecycleBoxLayout(
+            orientation='vertical',
+            default_size=(None, 220),
+            default_size_hint=(1, None),
+            size_hint_y=None,
+            spacing=10
+        )
 
-        # Set the height of the GridLayout to be determined by its content
-        self.grid_layout.bind(minimum_height=self.grid_layout.setter('height'))
+        # Set the height of the layout to be determined by its content
+        self.results_layout.bind(minimum_height=self.results_layout.setter('height'))
 
-        # Add the GridLayout to the ScrollView
-        self.scrollview.add_widget(self.grid_layout)
+        # Load the next page as the user nears the bottom of the list
+        self.recycleview.bind(scroll_y=self.on_scroll)
 
-        # Add the ScrollView to the main layout
-        self.layout.add_widget(self.scrollview)
+        # Add the layout to the RecycleView
+        self.recycleview.add_widget(self.results_layout)
+
+        # Add the RecycleView to the main layout
+        self.layout.add_widget(self.recycleview)
 
         # Back button
         self.back_button = Button(text='Back', size_hint=(None, None), size=(100, 50))
@@ -630,28 +812,95 @@ class SearchResults(Screen):
 
         self.add_widget(self.layout)
 
-    def on_results_text(self, results):
-        # Clear any previous search results
-        self.grid_layout.clear_widgets()
+        self.filters = None
+        self.keywords = ''
+        self.last_id = None
+        self.has_more = False
+        self.job = None
+
+    def start_search(self, filters, keywords=''):
+        # Clear any previous search results and show the first page straight away
+        self.cancel_job()
+        self.filters = filters
+        self.keywords = keywords
+        self.last_id = None
+        self.has_more = True
+        self.recycleview.data = []
+        self.recycleview.scroll_y = 1
+        self.load_next_page()
+
+    def load_next_page(self):
+        # Only one page is fetched at a time
+        if not self.has_more or self.job is not None:
+            return
+
+        if not self.recycleview.data:
+            self.count_label.text = "Searching..."
 
-        # Add each attribute name in front of its corresponding value and format them
-        for result in results:
-            result_layout = BoxLayout(orientation='vertical', spacing=30, size_hint_y=None, padding=(0, 40))
-            result_layout.bind(minimum_height=result_layout.setter('height'))
+        app = App.get_running_app()
+        if self.keywords:
+            # Station and number searches go through the full-text index,
+            # newest sightings first
+            self.job = app.worker.submit(
+                app.db.text_search, self.keywords, *self.filters,
+                before_id=self.last_id,
+                callback=self.on_page_loaded,
+                error_callback=self.on_page_failed
+            )
+        else:
+            self.job = app.worker.submit(
+                app.db.search_logs, *self.filters,
+                after_id=self.last_id or 0,
+                callback=self.on_page_loaded,
+                error_callback=self.on_page_failed
+            )
 
-            labels = [
-                f"Class: {result[1]}",
-                f"Number: {result[2]}",
-                f"Special Livery: {result[3]}",
-                f"Rare: {result[4]}",
-                f"Driver Interaction: {result[5]}"
-            ]
-            for label in labels:
-                result_label = Label(text=label, font_size=20, halign='left', valign='middle')
-                result_layout.add_widget(result_label)
+    def on_page_loaded(self, results):
+        self.job = None
 
-            self.grid_layout.add_widget(result_layout)
+        # A short page means there is nothing left to fetch
+        self.has_more = len(results) == SEARCH_PAGE_SIZE
+        if results:
+            self.last_id = results[-1][6]
+        self.on_results_text(results)
 
+    def on_page_failed(self, error):
+        self.job = None
+        self.has_more = False
+        self.count_label.text = "Search failed"
+
+    def cancel_job(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+
+    def on_leave(self):
+        # Drop a page still being fetched when the user goes back
+        self.cancel_job()
+
+    def on_scroll(self, instance, scroll_y):
+        if scroll_y <= 0.1:
+            self.load_next_page()
+
+    def on_results_text(self, results):
+        # Append one small dict per row to the results
+        self.recycleview.data.extend([{'text': self.format_result(result)} for result in results])
+
+        # The full count is only known once the last page has been read
+        count = len(self.recycleview.data)
+        self.count_label.text = f"{count}+ results" if self.has_more else f"{count} results"
+
+    def format_result(self, result):
+        # Add each attribute name in front of its corresponding value; the
+        # flags are stored as 0 or 1
+        return "\n".join([
+            f"Station: {result[0] or ''}",
+            f"Class: {result[1]}",
+            f"Number: {result[2]}",
+            f"Special Livery: {'Yes' if result[3] else 'No'}",
+            f"Rare: {'Yes' if result[4] else 'No'}",
+            f"Driver Interaction: {'Yes' if result[5] else 'No'}"
+        ])
 
     def go_back(self, instance):
         self.manager.current = 'search'
@@ -680,255 +929,34 @@ class Achievements(Screen):
         self.backbtn.bind(on_press=self.back_to_home)
         self.layout.add_widget(self.backbtn)
 
+        self.job = None
+        self.last_id = 0
+
     def on_enter(self):
-        # Fetch and display achievements every time the screen is shown
-        unlocked_achievements = self.check_achievements()
+        # Fetch any achievements unlocked since the screen was last shown
+        self.label.text = 'Achievements (loading...)'
+        app = App.get_running_app()
+        self.job = app.worker.submit(app.db.fetch_unlocked_achievements, self.last_id, callback=self.show_achievements)
+
+    def on_leave(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
 
-        # Clear any previous achievements from the GridLayout
-        self.achievements_layout.clear_widgets()
+    def show_achievements(self, unlocked_achievements):
+        self.job = None
+        self.label.text = 'Achievements'
 
-        # Add each achievement to the GridLayout
-        for achievement in unlocked_achievements:
-            achievement_label = Label(text=achievement, font_size=20, halign='left', valign='middle', size_hint_y=None, padding=(0, 40))
+        # Add each new achievement to the GridLayout; the ones already shown stay as they are
+        for achievement_id, title, unlocked_at, full_log_id in unlocked_achievements:
+            self.last_id = achievement_id
+            achievement_label = Label(text=describe_unlock(title, unlocked_at), font_size=20, halign='left', valign='middle', size_hint_y=None, padding=(0, 40))
             achievement_label.bind(texture_size=achievement_label.setter('size'))
             self.achievements_layout.add_widget(achievement_label)
 
     def back_to_home(self, instance):
         self.manager.current = 'home'
 
-    def fetch_total_data(self):
-        conn = sqlite3.connect('tp.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM Total')
-        total_data = cursor.fetchone()
-        conn.close()
-        return total_data
-
-    def fetch_train_count(self):
-        conn = sqlite3.connect('tp.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM FullLog')
-        train_count = cursor.fetchone()[0]
-        conn.close()
-        return train_count
-
-    def check_train_count_achievements(self, train_count):
-        achievements = {
-            1: "1st Train Logged",
-            10: "10th Train Logged",
-            25: "25th Train Logged",
-            100: "100th Train Logged",
-            250: "250th Train Logged",
-            1000: "1000th Train Logged",
-            1500: "1500th Train Logged",
-            2000: "2000th Train Logged",
-            5000: "5000th Train Logged",
-            10000: "10000th Train Logged",
-            20000: "20000th Train Logged",
-            30000: "30000th Train Logged",
-            40000: "40000th Train Logged",
-            50000: "50000th Train Logged",
-            60000: "60000th Train Logged",
-            70000: "70000th Train Logged",
-            80000: "80000th Train Logged",
-            90000: "90000th Train Logged",
-            100000: "100000th Train Logged",
-            1000000: "1000000th Train Logged"
-        }
-
-        unlocked_achievements = []
-        for count, achievement in achievements.items():
-            if train_count >= count:
-                unlocked_achievements.append(achievement)
-
-        return unlocked_achievements
-
-    def check_other_achievements(self, total_data):
-        unlocked_achievements = []
-
-        # Check and add special livery achievements
-        special_livery_count = total_data[1]
-        if special_livery_count >= 1:
-            unlocked_achievements.append("1st Special Livery")
-        if special_livery_count >= 5:
-            unlocked_achievements.append("5th Special Livery")
-        if special_livery_count >= 10:
-            unlocked_achievements.append("10th Special Livery")
-        if special_livery_count >= 25:
-            unlocked_achievements.append("25th Special Livery")
-        if special_livery_count >= 50:
-            unlocked_achievements.append("50th Special Livery")
-        if special_livery_count >= 75:
-            unlocked_achievements.append("75th Special Livery")
-        if special_livery_count >= 100:
-            unlocked_achievements.append("100th Special Livery")
-        if special_livery_count >= 150:
-            unlocked_achievements.append("150th Special Livery")
-        if special_livery_count >= 250:
-            unlocked_achievements.append("250th Special Livery")
-        if special_livery_count >= 500:
-            unlocked_achievements.append("500th Special Livery")
-        if special_livery_count >= 1000:
-            unlocked_achievements.append("1000th Special Livery")
-        if special_livery_count >= 2500:
-            unlocked_achievements.append("2500th Special Livery")
-        if special_livery_count >= 5000:
-            unlocked_achievements.append("5000th Special Livery")
-        if special_livery_count >= 10000:
-            unlocked_achievements.append("10000th Special Livery")
-        if special_livery_count >= 25000:
-            unlocked_achievements.append("25000th Special Livery")
-        if special_livery_count >= 50000:
-            unlocked_achievements.append("50000th Special Livery")
-        if special_livery_count >= 100000:
-            unlocked_achievements.append("100000th Special Livery")
-        if special_livery_count >= 250000:
-            unlocked_achievements.append("250000th Special Livery")
-        if special_livery_count >= 500000:
-            unlocked_achievements.append("500000th Special Livery")
-        if special_livery_count >= 1000000:
-            unlocked_achievements.append("1000000th Special Livery")
-        # Add more special livery achievements here for different counts
-
-        # Check and add rare achievements
-        rare_count = total_data[2]
-        if rare_count >= 1:
-            unlocked_achievements.append("1st Rare Train")
-        if rare_count >= 5:
-            unlocked_achievements.append("5th Rare Train")
-        if rare_count >= 10:
-            unlocked_achievements.append("10th Rare Train")
-        if rare_count >= 25:
-            unlocked_achievements.append("25th Rare Train")
-        if rare_count >= 50:
-            unlocked_achievements.append("50th Rare Train")
-        if rare_count >= 75:
-            unlocked_achievements.append("75th Rare Train")
-        if rare_count >= 100:
-            unlocked_achievements.append("100th Rare Train")
-        if rare_count >= 150:
-            unlocked_achievements.append("150th Rare Train")
-        if rare_count >= 250:
-            unlocked_achievements.append("250th Rare Train")
-        if rare_count >= 500:
-            unlocked_achievements.append("500th Rare Train")
-        if rare_count >= 1000:
-            unlocked_achievements.append("1000th Rare Train")
-        if rare_count >= 2500:
-            unlocked_achievements.append("2500th Rare Train")
-        if rare_count >= 5000:
-            unlocked_achievements.append("5000th Rare Train")
-        if rare_count >= 10000:
-            unlocked_achievements.append("10000th Rare Train")
-        if rare_count >= 25000:
-            unlocked_achievements.append("25000th Rare Train")
-        if rare_count >= 50000:
-            unlocked_achievements.append("50000th Rare Train")
-        if rare_count >= 100000:
-            unlocked_achievements.append("100000th Rare Train")
-        if rare_count >= 250000:
-            unlocked_achievements.append("250000th Rare Train")
-        if rare_count >= 500000:
-            unlocked_achievements.append("500000th Rare Train")
-        if rare_count >= 1000000:
-            unlocked_achievements.append("1000000th Rare Train")
-        # Add more rare achievements here for different counts
-
-        # Check and add driver interaction achievements
-        driver_interaction_count = total_data[3]
-        if driver_interaction_count >= 1:
-            unlocked_achievements.append("1st Driver Interaction")
-        if driver_interaction_count >= 5:
-            unlocked_achievements.append("5th Driver Interaction")
-        if driver_interaction_count >= 10:
-            unlocked_achievements.append("10th Driver Interaction")
-        if driver_interaction_count >= 25:
-            unlocked_achievements.append("25th Driver Interaction")
-        if driver_interaction_count >= 50:
-            unlocked_achievements.append("50th Driver Interaction")
-        if driver_interaction_count >= 75:
-            unlocked_achievements.append("75th Driver Interaction")
-        if driver_interaction_count >= 100:
-            unlocked_achievements.append("100th Driver Interaction")
-        if driver_interaction_count >= 150:
-            unlocked_achievements.append("150th Driver Interaction")
-        if driver_interaction_count >= 250:
-            unlocked_achievements.append("250th Driver Interaction")
-        if driver_interaction_count >= 500:
-            unlocked_achievements.append("500th Driver Interaction")
-        if driver_interaction_count >= 1000:
-            unlocked_achievements.append("1000th Driver Interaction")
-        if driver_interaction_count >= 2500:
-            unlocked_achievements.append("2500th Driver Interaction")
-        if driver_interaction_count >= 5000:
-            unlocked_achievements.append("5000th Driver Interaction")
-        if driver_interaction_count >= 10000:
-            unlocked_achievements.append("10000th Driver Interaction")
-        if driver_interaction_count >= 25000:
-            unlocked_achievements.append("25000th Driver Interaction")
-        if driver_interaction_count >= 50000:
-            unlocked_achievements.append("50000th Driver Interaction")
-        if driver_interaction_count >= 100000:
-            unlocked_achievements.append("100000th Driver Interaction")
-        if driver_interaction_count >= 250000:
-            unlocked_achievements.append("250000th Driver Interaction")
-        if driver_interaction_count >= 500000:
-            unlocked_achievements.append("500000th Driver Interaction")
-        if driver_interaction_count >= 1000000:
-            unlocked_achievements.append("1000000th Driver Interaction")
-
-        # Add more driver interaction achievements here for different counts
-
-        # Check and add quantity of the same train achievements
-        conn = sqlite3.connect('tp.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT MAX(Quantity) FROM Basic')
-        max_quantity = cursor.fetchone()[0]
-        conn.close()
-
-        
-        if max_quantity >= 2:
-            unlocked_achievements.append("1st of the same train")
-        if max_quantity >= 5:
-            unlocked_achievements.append("5th of the same train")
-        if max_quantity >= 10:
-            unlocked_achievements.append("10th of the same train")
-        if max_quantity >= 15:
-            unlocked_achievements.append("15th of the same train")
-        if max_quantity >= 20:
-            unlocked_achievements.append("20th of the same train")
-        if max_quantity >= 30:
-            unlocked_achievements.append("30th of the same train")
-        if max_quantity >= 50:
-            unlocked_achievements.append("50th of the same train")
-        if max_quantity >= 75:
-            unlocked_achievements.append("75th of the same train")
-        if max_quantity >= 100:
-            unlocked_achievements.append("100th of the same train")
-        if max_quantity >= 250:
-            unlocked_achievements.append("250th of the same train")
-        if max_quantity >= 500:
-            unlocked_achievements.append("500th of the same train")
-        if max_quantity >= 1000:
-            unlocked_achievements.append("1000th of the same train")
-
-        return unlocked_achievements
-
-    def check_achievements(self):
-        # Fetch the train count
-        train_count = self.fetch_train_count()
-
-        # Check train count-based achievements
-        unlocked_achievements = self.check_train_count_achievements(train_count)
-
-        # Fetch the total data
-        total_data = self.fetch_total_data()
-
-        # Check other achievements based on total data
-        unlocked_achievements.extend(self.check_other_achievements(total_data))
-
-        return unlocked_achievements
-
 
 class Statistics(Screen):
     def __init__(self, **kwargs):
@@ -938,6 +966,15 @@ class Statistics(Screen):
         self.label = Label(text='Statistics', font_size=30, size_hint=(1, 0.1))
         self.layout.add_widget(self.label)
 
+        # One button per period; all time is shown first
+        self.period = 'all'
+        self.period_buttons = BoxLayout(orientation='horizontal', spacing=5, size_hint=(1, 0.1))
+        for period, period_label in PERIOD_LABELS:
+            button = Button(text=period_label, font_size=18)
+            button.bind(on_press=lambda instance, period=period: self.select_period(period))
+            self.period_buttons.add_widget(button)
+        self.layout.add_widget(self.period_buttons)
+
         # Add statistics labels
         self.total_trains_label = Label(text='Total Trains Logged: 0', font_size=20,size_hint_y=None, padding=(0, 20))
         self.layout.add_widget(self.total_trains_label)
@@ -954,58 +991,314 @@ class Statistics(Screen):
         self.most_common_train_label = Label(text='Most Common Train: None', font_size=20,size_hint_y=None, padding=(0, 20))
         self.layout.add_widget(self.most_common_train_label)
 
+        self.leaderboards_button = Button(text='Leaderboards', font_size=30, size_hint=(1, 0.2))
+        self.leaderboards_button.bind(on_press=self.goto_leaderboards)
+        self.layout.add_widget(self.leaderboards_button)
+
+        self.breakdown_button = Button(text='By Station and Class', font_size=30, size_hint=(1, 0.2))
+        self.breakdown_button.bind(on_press=self.goto_breakdown)
+        self.layout.add_widget(self.breakdown_button)
+
         self.backbtn = Button(text='Back', font_size=30, size_hint=(1, 0.2))
         self.backbtn.bind(on_press=self.back_to_home)
         self.layout.add_widget(self.backbtn)
 
+        self.job = None
+
     def on_enter(self):
-        # Fetch and display statistics every time the screen is shown
-        statistics = self.fetch_statistics()
+        # Show the cached statistics straight away if nothing has been logged
+        # since they were last read, otherwise fetch them in the background.
+        # The snapshot is read without the database lock, which a job on the
+        # worker may be holding; a write only ever replaces it with None
+        app = App.get_running_app()
+        statistics = app.db.statistics
+        if self.period == 'all' and statistics is not None:
+            self.show_statistics(dict(statistics))
+            return
+
+        self.label.text = f'Statistics - {self.period_label()} (loading...)'
+        self.job = app.worker.submit(self.fetch_statistics, callback=self.show_statistics)
+
+    def on_leave(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+
+    def select_period(self, period):
+        # Show the statistics for another period
+        self.on_leave()
+        self.period = period
+        self.on_enter()
+
+    def period_label(self):
+        return dict(PERIOD_LABELS)[self.period]
+
+    def show_statistics(self, statistics):
+        self.job = None
+        self.label.text = f'Statistics - {self.period_label()}'
 
         # Update statistics labels
-        self.total_trains_label.text = f'Total Trains Logged: {statistics["total_trains"]}'
-        self.special_livery_label.text = f'Special Livery Trains: {statistics["special_livery"]}'
-        self.rare_trains_label.text = f'Rare Trains: {statistics["rare_trains"]}'
-        self.driver_interaction_label.text = f'Trains with Driver Interaction: {statistics["driver_interaction"]}'
-        self.most_common_train_label.text = f'Most Common Train: {statistics["most_common_train"]}'
+        labels = [
+            self.total_trains_label,
+            self.special_livery_label,
+            self.rare_trains_label,
+            self.driver_interaction_label,
+            self.most_common_train_label,
+        ]
+        for label, (name, value) in zip(labels, describe_statistics(statistics)):
+            label.text = f'{name}: {value}'
 
     def back_to_home(self, instance):
         self.manager.current = 'home'
 
+    def goto_leaderboards(self, instance):
+        self.manager.current = 'leaderboards'
+
+    def goto_breakdown(self, instance):
+        self.manager.current = 'breakdown'
+
     def fetch_statistics(self):
-        conn = sqlite3.connect('tp.db')
-        cursor = conn.cursor()
-
-        # Get the total number of trains logged
-        cursor.execute('SELECT COUNT(*) FROM FullLog')
-        total_trains = cursor.fetchone()[0]
-
-        # Get the count of special livery trains
-        cursor.execute('SELECT COUNT(*) FROM FullLog WHERE SpecialLivery = "Yes"')
-        special_livery = cursor.fetchone()[0]
-
-        # Get the count of rare trains
-        cursor.execute('SELECT COUNT(*) FROM FullLog WHERE Rare = "Yes"')
-        rare_trains = cursor.fetchone()[0]
-
-        # Get the count of trains with driver interaction
-        cursor.execute('SELECT COUNT(*) FROM FullLog WHERE DriverInteraction = "Yes"')
-        driver_interaction = cursor.fetchone()[0]
-
-        # Get the most common train
-        cursor.execute('SELECT Class, Number, MAX(Quantity) FROM Basic')
-        most_common_train = cursor.fetchone()
-        most_common_train_text = f'{most_common_train[0]} {most_common_train[1]} ({most_common_train[2]} times)' if most_common_train else 'None'
-
-        conn.close()
-
-        return {
-            "total_trains": total_trains,
-            "special_livery": special_livery,
-            "rare_trains": rare_trains,
-            "driver_interaction": driver_interaction,
-            "most_common_train": most_common_train_text,
-        }
+        return App.get_running_app().db.fetch_statistics(self.period)
+
+
+class Leaderboards(Screen):
+    # The top ten of one leaderboard at a time. Each one is a short read of
+    # an index, so it is fetched again every time it is shown
+    def __init__(self, **kwargs):
+        super(Leaderboards, self).__init__(**kwargs)
+        self.layout = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        self.add_widget(self.layout)
+        self.label = Label(text='Leaderboards', font_size=30, size_hint=(1, 0.1))
+        self.layout.add_widget(self.label)
+
+        # One button per leaderboard
+        self.board = LEADERBOARD_LABELS[0][0]
+        self.board_buttons = BoxLayout(orientation='horizontal', spacing=5, size_hint=(1, 0.1))
+        for board, board_label in LEADERBOARD_LABELS:
+            button = Button(text=board_label, font_size=18)
+            button.bind(on_press=lambda instance, board=board: self.select_board(board))
+            self.board_buttons.add_widget(button)
+        self.layout.add_widget(self.board_buttons)
+
+        self.entries_label = Label(text='', font_size=20, halign='center', valign='top')
+        self.entries_label.bind(size=self.entries_label.setter('text_size'))
+        self.layout.add_widget(self.entries_label)
+
+        self.backbtn = Button(text='Back', font_size=30, size_hint=(1, 0.15))
+        self.backbtn.bind(on_press=self.back_to_statistics)
+        self.layout.add_widget(self.backbtn)
+
+        self.job = None
+
+    def on_enter(self):
+        app = App.get_running_app()
+        self.label.text = f'{dict(LEADERBOARD_LABELS)[self.board]} (loading...)'
+        self.job = app.worker.submit(app.db.leaderboard, self.board, callback=self.show_leaderboard)
+
+    def on_leave(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+
+    def select_board(self, board):
+        self.on_leave()
+        self.board = board
+        self.on_enter()
+
+    def show_leaderboard(self, rows):
+        self.job = None
+        self.label.text = dict(LEADERBOARD_LABELS)[self.board]
+        self.entries_label.text = '\n'.join(describe_leaderboard(self.board, rows))
+
+    def back_to_statistics(self, instance):
+        self.manager.current = 'statistics'
+
+
+class Breakdown(Screen):
+    # The totals of every station or class, most sightings first, read
+    # straight from the tables maintained as sightings are logged. On
+    # Android a roster is picked with the system file picker, whose result
+    # comes back with PICK_ROSTER_REQUEST
+    PICK_ROSTER_REQUEST = 0x7253
+
+    def __init__(self, **kwargs):
+        super(Breakdown, self).__init__(**kwargs)
+        self.layout = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        self.add_widget(self.layout)
+        self.label = Label(text='Statistics', font_size=30, size_hint=(1, 0.1))
+        self.layout.add_widget(self.label)
+
+        self.kind = BREAKDOWN_LABELS[0][0]
+        self.kind_buttons = BoxLayout(orientation='horizontal', spacing=5, size_hint=(1, 0.1))
+        for kind, kind_label in BREAKDOWN_LABELS:
+            button = Button(text=kind_label, font_size=18)
+            button.bind(on_press=lambda instance, kind=kind: self.select_kind(kind))
+            self.kind_buttons.add_widget(button)
+        self.layout.add_widget(self.kind_buttons)
+
+        # One row per station or class; there may be hundreds of stations
+        self.recycleview = RecycleView()
+        self.recycleview.viewclass = ResultRow
+        self.rows_layout = RecycleBoxLayout(
+            orientation='vertical',
+            default_size=(None, 200),
+            default_size_hint=(1, None),
+            size_hint_y=None,
+            spacing=10
+        )
+        self.rows_layout.bind(minimum_height=self.rows_layout.setter('height'))
+        self.recycleview.add_widget(self.rows_layout)
+        self.layout.add_widget(self.recycleview)
+
+        # No roster ships with the app; the user loads one from a CSV file
+        self.rosterbtn = Button(text='Load Roster', font_size=30, size_hint=(1, 0.15))
+        self.rosterbtn.bind(on_press=self.open_roster_chooser)
+        self.layout.add_widget(self.rosterbtn)
+
+        self.backbtn = Button(text='Back', font_size=30, size_hint=(1, 0.15))
+        self.backbtn.bind(on_press=self.back_to_statistics)
+        self.layout.add_widget(self.backbtn)
+
+        self.job = None
+
+    def on_enter(self):
+        app = App.get_running_app()
+        self.label.text = f'Statistics - {dict(BREAKDOWN_LABELS)[self.kind]} (loading...)'
+        self.job = app.worker.submit(self.fetch_breakdown, self.kind, callback=self.show_breakdown)
+
+    def on_leave(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+
+    def select_kind(self, kind):
+        self.on_leave()
+        self.kind = kind
+        self.on_enter()
+
+    def fetch_breakdown(self, kind):
+        # Runs on the worker. Classes on the roster also show how many of
+        # their units have been seen
+        db = App.get_running_app().db
+        completion = {row[0]: row for row in db.roster_completion()} if kind == 'class' else {}
+        return db.fetch_breakdown(kind), completion
+
+    def show_breakdown(self, result):
+        self.job = None
+        rows, completion = result
+        self.label.text = f'Statistics - {dict(BREAKDOWN_LABELS)[self.kind]}'
+        data = []
+        for row in rows:
+            lines = [f'{name}: {value}' for name, value in describe_breakdown(self.kind, row)]
+            if row[0] in completion:
+                lines.append('Roster: ' + format_progress(*completion[row[0]][1:]))
+            data.append({'text': '\n'.join(lines)})
+        self.recycleview.data = data
+        self.recycleview.scroll_y = 1
+
+    def open_roster_chooser(self, instance):
+        # Pick a roster file. On Android the system file picker can open
+        # files in shared storage, such as Downloads, which the app has no
+        # permission to list itself. Elsewhere Kivy's file chooser is used;
+        # it is only imported when it is first needed
+        if platform == 'android':
+            self.open_android_picker()
+            return
+        from kivy.uix.filechooser import FileChooserListView
+        content = BoxLayout(orientation='vertical', spacing=10)
+        chooser = FileChooserListView(path=os.path.expanduser('~'), filters=['*.csv'])
+        content.add_widget(chooser)
+        buttons = BoxLayout(orientation='horizontal', spacing=10, size_hint=(1, 0.15))
+        loadbtn = Button(text='Load', font_size=24)
+        cancelbtn = Button(text='Cancel', font_size=24)
+        buttons.add_widget(loadbtn)
+        buttons.add_widget(cancelbtn)
+        content.add_widget(buttons)
+        popup = Popup(
+            title='Roster CSV file with Class and Number columns',
+            content=content,
+            size_hint=(0.9, 0.9)
+        )
+        loadbtn.bind(on_press=lambda instance: self.load_roster(popup, chooser.selection))
+        cancelbtn.bind(on_press=popup.dismiss)
+        popup.open()
+
+    def open_android_picker(self):
+        from android import activity, mActivity
+        from jnius import autoclass
+        Intent = autoclass('android.content.Intent')
+        intent = Intent(Intent.ACTION_OPEN_DOCUMENT)
+        intent.addCategory(Intent.CATEGORY_OPENABLE)
+        # File managers don't agree on a MIME type for CSV files
+        intent.setType('*/*')
+        activity.bind(on_activity_result=self.on_android_picked)
+        mActivity.startActivityForResult(intent, self.PICK_ROSTER_REQUEST)
+
+    def on_android_picked(self, request_code, result_code, intent):
+        # Runs on the Android UI thread. The picked document is only readable
+        # through its content URI, so it is copied into the app's own storage
+        # and loaded from there; picking a file again replaces the copy
+        if request_code != self.PICK_ROSTER_REQUEST:
+            return
+        from android import activity, mActivity
+        from jnius import autoclass
+        activity.unbind(on_activity_result=self.on_android_picked)
+        if result_code != autoclass('android.app.Activity').RESULT_OK or intent is None:
+            return
+        path = os.path.join(App.get_running_app().user_data_dir, 'roster.csv')
+        BufferedReader = autoclass('java.io.BufferedReader')
+        InputStreamReader = autoclass('java.io.InputStreamReader')
+        try:
+            reader = BufferedReader(InputStreamReader(
+                mActivity.getContentResolver().openInputStream(intent.getData()), 'UTF-8'))
+            try:
+                with open(path, 'w', newline='', encoding='utf-8') as f:
+                    line = reader.readLine()
+                    while line is not None:
+                        f.write(line + '\n')
+                        line = reader.readLine()
+            finally:
+                reader.close()
+        except Exception as error:
+            Clock.schedule_once(lambda dt: self.on_roster_failed(error))
+            return
+        Clock.schedule_once(lambda dt: self.submit_roster(path))
+
+    def load_roster(self, popup, selection):
+        if not selection:
+            return
+        popup.dismiss()
+        self.submit_roster(selection[0])
+
+    def submit_roster(self, path):
+        # Load a roster file on the worker
+        app = App.get_running_app()
+        self.label.text = 'Loading roster...'
+        app.worker.submit(
+            load_roster_file, app.db, path, force=True,
+            callback=lambda count: self.on_roster_loaded(path, count),
+            error_callback=self.on_roster_failed
+        )
+
+    def on_roster_loaded(self, path, count):
+        # Show the class breakdown with the new roster progress
+        self.select_kind('class')
+        Popup(
+            title='Roster loaded',
+            content=Label(text=f'Loaded {count} units from\n{os.path.basename(path)}', font_size=24),
+            size_hint=(0.8, 0.4)
+        ).open()
+
+    def on_roster_failed(self, error):
+        self.label.text = f'Statistics - {dict(BREAKDOWN_LABELS)[self.kind]}'
+        Popup(
+            title='Could not load the roster',
+            content=Label(text=str(error), font_size=24),
+            size_hint=(0.8, 0.4)
+        ).open()
+
+    def back_to_statistics(self, instance):
+        self.manager.current = 'statistics'
 
 
 if __name__ == '__main__':
@@ -0,0 +1,113 @@
+"""Tests for the SQL built by SightingQuery and the plans SQLite picks for it."""
+import pytest
+
+from trainspotter.database import Database
+from trainspotter.query import RESULT_COLUMNS, SightingQuery
+
+SELECT = f"SELECT {', '.join(RESULT_COLUMNS)} FROM Sightings"
+
+
+@pytest.fixture
+def db():
+    db = Database(":memory:")
+    db.create_tables()
+    yield db
+    db.close()
+
+
+def test_no_filters():
+    assert SightingQuery().build() == (SELECT + " ORDER BY ID", ())
+
+
+def test_any_flag_adds_no_condition():
+    query = SightingQuery().flags(None, None, None)
+    assert query.build() == (SELECT + " ORDER BY ID", ())
+
+
+def test_flags_are_literals():
+    sql, params = SightingQuery().flags(True, None, False).build()
+    assert sql == SELECT + " WHERE SpecialLivery = 1 AND DriverInteraction = 0 ORDER BY ID"
+    assert params == ()
+
+
+def test_unknown_flag():
+    with pytest.raises(ValueError):
+        SightingQuery().flag("Class", True)
+
+
+def test_single_class():
+    sql, params = SightingQuery().classes("66").build(limit=200)
+    assert sql == SELECT + " WHERE Class = ? ORDER BY ID LIMIT ?"
+    assert params == ("66", 200)
+
+
+def test_several_classes():
+    sql, params = SightingQuery().classes("66", "70", "66", "").build()
+    assert sql == SELECT + " WHERE Class IN (?, ?) ORDER BY ID"
+    assert params == ("66", "70")
+
+
+def test_number_prefix_is_a_range():
+    sql, params = SightingQuery().number("4319", prefix=True).build()
+    assert sql == SELECT + " WHERE Number >= ? AND Number < ? ORDER BY ID"
+    assert params == ("4319", "431:")
+
+
+def test_exact_number():
+    sql, params = SightingQuery().number(" 66001 ").build()
+    assert sql == SELECT + " WHERE Number = ? ORDER BY ID"
+    assert params == ("66001",)
+
+
+def test_page_after_id():
+    sql, params = SightingQuery().classes("66").page(500).build(limit=200)
+    assert sql == SELECT + " WHERE Class = ? AND ID > ? ORDER BY ID LIMIT ?"
+    assert params == ("66", 500, 200)
+
+
+def test_page_newest_first():
+    sql, params = SightingQuery().order("newest").page(500).build()
+    assert sql == SELECT + " WHERE ID < ? ORDER BY ID DESC"
+    assert params == (500,)
+
+
+def test_page_on_date_and_id():
+    query = SightingQuery().order("earliest")
+    row = ("Crewe", "66", "66001", 0, 0, 0, 42, 1700000000)
+    key = query.page_key(row, RESULT_COLUMNS + ("DateTime",))
+    assert key == (1700000000, 42)
+    sql, params = query.page(key).build()
+    assert sql == SELECT + " WHERE (DateTime, ID) > (?, ?) ORDER BY DateTime, ID"
+    assert params == (1700000000, 42)
+
+
+def test_copy_leaves_the_original_alone():
+    query = SightingQuery().classes("66")
+    query.copy().page(10)
+    assert query.build() == (SELECT + " WHERE Class = ? ORDER BY ID", ("66",))
+
+
+def full_scans(db, query):
+    sql, params = query.build(limit=200)
+    return [detail for detail in db.explain(sql, params) if detail.startswith("SCAN FullLog")]
+
+
+@pytest.mark.parametrize("query", [
+    SightingQuery().classes("66"),
+    SightingQuery().classes("66", "70"),
+    SightingQuery().classes("66").page(1000),
+    SightingQuery().classes("66").flag("DriverInteraction", False),
+    SightingQuery().classes("66").flag("Rare", True),
+    SightingQuery().classes("66", "70").flags(True, None, None),
+])
+def test_class_searches_use_an_index(db, query):
+    assert full_scans(db, query) == []
+
+
+def test_results(db):
+    db.insert_log("Crewe", "66", "66001", False, True, False)
+    db.insert_log("York", "70", "70001", False, False, True)
+    db.insert_log("Crewe", "66", "66002", False, False, False)
+    query = SightingQuery().classes("66").flag("Rare", False)
+    sql, params = query.build()
+    assert db.conn.execute(sql, params).fetchall() == [("Crewe", "66", "66002", 0, 0, 0, 3)]
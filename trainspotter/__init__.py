@@ -0,0 +1,3 @@
+"""Core data layer for the Train Spotter app."""
+from .database import DB_PATH, Database
+from .worker import Worker
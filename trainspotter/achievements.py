@@ -0,0 +1,92 @@
+"""Achievement registry and evaluation.
+
+Each category is a metric from the aggregate snapshot plus a sorted list of
+thresholds. New achievements are added here as data; evaluating a category
+is a binary search over its thresholds.
+"""
+import time
+from bisect import bisect_right
+
+
+def ordinal(n):
+    if 10 <= n % 100 <= 20:
+        suffix = "th"
+    else:
+        suffix = {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+    return f"{n}{suffix}"
+
+
+class Category:
+    def __init__(self, name, metric, thresholds, title, ranks=None):
+        self.name = name
+        self.metric = metric
+        self.thresholds = tuple(thresholds)
+        # The number shown in a title is normally the threshold itself, but
+        # a category can number its achievements differently
+        ranks = ranks or self.thresholds
+        self.titles = tuple(title.format(ordinal(rank)) for rank in ranks)
+        assert list(self.thresholds) == sorted(self.thresholds)
+        assert len(self.titles) == len(self.thresholds)
+
+    def unlocked(self, value):
+        # All titles whose threshold is at or below the value
+        return self.titles[:bisect_right(self.thresholds, value or 0)]
+
+    def crossed(self, before, after):
+        # The (threshold, title) pairs passed when the metric went from before to after
+        start = bisect_right(self.thresholds, before or 0)
+        end = bisect_right(self.thresholds, after or 0)
+        return list(zip(self.thresholds[start:end], self.titles[start:end]))
+
+
+MILESTONES = (
+    1, 5, 10, 25, 50, 75, 100, 150, 250, 500, 1000, 2500, 5000,
+    10000, 25000, 50000, 100000, 250000, 500000, 1000000,
+)
+
+CATEGORIES = (
+    Category(
+        "trains", "train_count",
+        (1, 10, 25, 100, 250, 1000, 1500, 2000, 5000, 10000, 20000, 30000,
+         40000, 50000, 60000, 70000, 80000, 90000, 100000, 1000000),
+        "{} Train Logged",
+    ),
+    Category("special_livery", "special_livery", MILESTONES, "{} Special Livery"),
+    Category("rare", "rare", MILESTONES, "{} Rare Train"),
+    Category("driver_interaction", "driver_interaction", MILESTONES, "{} Driver Interaction"),
+    # The first "same train" achievement is for seeing a train a second time
+    Category(
+        "same_train", "max_quantity",
+        (2, 5, 10, 15, 20, 30, 50, 75, 100, 250, 500, 1000),
+        "{} of the same train",
+        ranks=(1, 5, 10, 15, 20, 30, 50, 75, 100, 250, 500, 1000),
+    ),
+)
+
+# The metric of each category, by name
+METRICS = {category.name: category.metric for category in CATEGORIES}
+
+
+def evaluate(snapshot):
+    # snapshot maps each metric name to its current value
+    unlocked_achievements = []
+    for category in CATEGORIES:
+        unlocked_achievements.extend(category.unlocked(snapshot[category.metric]))
+    return unlocked_achievements
+
+
+def crossed(before, after):
+    # (category name, threshold, title) for every achievement unlocked
+    # between two snapshots
+    unlocks = []
+    for category in CATEGORIES:
+        for threshold, title in category.crossed(before.get(category.metric), after.get(category.metric)):
+            unlocks.append((category.name, threshold, title))
+    return unlocks
+
+
+def describe_unlock(title, unlocked_at):
+    # The title, with the date it was unlocked when that is known
+    if unlocked_at is None:
+        return title
+    return f"{title} (unlocked on {time.strftime('%d/%m/%Y', time.localtime(unlocked_at))})"
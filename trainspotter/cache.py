@@ -0,0 +1,83 @@
+"""In-memory LRU cache of search result pages.
+
+Going back and forth between the Search and results screens, or running
+the same few searches again, asks for the same pages over and over. Pages
+are kept here under their normalised search, up to a rough memory budget,
+least recently used first out.
+
+Rather than clearing the cache on every write, the cache has a generation
+number that the database bumps each time the log is written to. A page is
+stamped with the generation it was read in, and a page from an older one is
+stale: it is dropped when it is next looked up, or evicted in the meantime.
+"""
+import sys
+from collections import OrderedDict
+
+# Rough number of bytes the cached pages may take up
+CACHE_BUDGET = 4 * 1024 * 1024
+
+
+def page_size(rows):
+    # Approximate size of a page of rows in bytes. Values shared between
+    # rows, such as small integers, are counted every time, so this errs on
+    # the high side
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return size
+
+
+class PageCache:
+    def __init__(self, budget=CACHE_BUDGET):
+        self.budget = budget
+        self.generation = 0
+        # key -> (generation, rows, size), least recently used first
+        self.pages = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self):
+        # Mark every page cached so far as stale
+        self.generation += 1
+
+    def get(self, key):
+        # The rows cached for key, or None on a miss
+        entry = self.pages.get(key)
+        if entry is not None and entry[0] == self.generation:
+            self.pages.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+        if entry is not None:
+            self._drop(key)
+        self.misses += 1
+        return None
+
+    def put(self, key, rows):
+        # Cache the rows for key in the current generation. A page bigger
+        # than the whole budget isn't kept
+        size = page_size(rows)
+        if size > self.budget:
+            return
+        if key in self.pages:
+            self._drop(key)
+        self.pages[key] = (self.generation, list(rows), size)
+        self.size += size
+        while self.size > self.budget:
+            self._drop(next(iter(self.pages)))
+
+    def _drop(self, key):
+        self.size -= self.pages.pop(key)[2]
+
+    def clear(self):
+        self.pages.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "pages": len(self.pages),
+            "bytes": self.size,
+            "generation": self.generation,
+        }
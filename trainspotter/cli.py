@@ -0,0 +1,315 @@
+"""Command line interface to the Train Spotter database.
+
+Usage: python -m trainspotter <command> [options]
+
+Commands: log, search, history, stats, leaders, roster, achievements,
+import, export, rebuild.
+This module must not import Kivy, so it starts quickly and runs on
+machines without a display.
+"""
+import argparse
+import sys
+import time
+
+from . import exporter, importer, roster
+from .achievements import describe_unlock
+from .database import BREAKDOWNS, DB_PATH, LEADERBOARD_SIZE, LEADERBOARDS, PERIODS, Database
+from .query import ORDERS, RESULT_COLUMNS
+from .statistics import LEADERBOARD_LABELS, describe_breakdown, describe_leaderboard, describe as describe_statistics
+
+
+def open_database(args):
+    db = Database(args.db)
+    db.create_tables()
+    return db
+
+
+def yes_no(value):
+    return "Yes" if value else "No"
+
+
+def cmd_log(args):
+    db = open_database(args)
+    try:
+        unlocked, cops = db.insert_log(
+            args.station, args.train_class, args.number,
+            args.livery, args.rare, args.interaction
+        )
+    finally:
+        db.close()
+
+    print(f"Logged {args.train_class} {args.number} at {args.station}")
+    for title in unlocked:
+        print("Achievement unlocked: " + title)
+    for cop in cops:
+        print(cop)
+    return 0
+
+
+# Search results with the date they were seen, to page through them by date
+COLUMNS = RESULT_COLUMNS + ("DateTime",)
+
+
+def parse_date_argument(value):
+    # None, or a date accepted by the importer as a Unix timestamp
+    return importer.parse_datetime(value) if value else None
+
+
+def cmd_search(args):
+    try:
+        start, end = parse_date_argument(args.since), parse_date_argument(args.until)
+    except ValueError as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+
+    db = open_database(args)
+    filters = (args.train_class, args.livery, args.rare, args.interaction)
+    query = None
+    if not args.text:
+        query = db.search_query(*filters).station(args.station).number(args.number, prefix=args.prefix)
+        query.since(start).until(end).order(args.sort)
+    count = 0
+    try:
+        # Walk the result pages the same way the results screen does
+        last = None
+        while args.limit is None or count < args.limit:
+            if args.text:
+                results = db.text_search(args.text, *filters, before_id=last)
+            else:
+                results = db.find(query.copy().page(last), columns=COLUMNS)
+            if not results:
+                break
+            for station, train_class, number, special_livery, rare, driver_interaction, log_id, *_ in results:
+                if args.limit is not None and count >= args.limit:
+                    break
+                print(f"{log_id}\t{station or ''}\t{train_class}\t{number}\t"
+                      f"livery={yes_no(special_livery)}\trare={yes_no(rare)}\tinteraction={yes_no(driver_interaction)}")
+                count += 1
+            last = results[-1][6] if args.text else query.page_key(results[-1], COLUMNS)
+    finally:
+        db.close()
+
+    print(f"{count} results", file=sys.stderr)
+    return 0
+
+
+def cmd_history(args):
+    # Sightings between two dates, oldest first
+    try:
+        start = importer.parse_datetime(args.since)
+        end = importer.parse_datetime(args.until) if args.until else int(time.time()) + 1
+    except ValueError as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+
+    db = open_database(args)
+    count = 0
+    try:
+        after = None
+        while True:
+            results = db.sightings_between(start, end, after)
+            if not results:
+                break
+            for station, train_class, number, special_livery, rare, driver_interaction, log_id, seen_at in results:
+                print(f"{time.strftime('%d/%m/%Y %H:%M', time.localtime(seen_at))}\t{station or ''}\t"
+                      f"{train_class}\t{number}\tlivery={yes_no(special_livery)}\trare={yes_no(rare)}\t"
+                      f"interaction={yes_no(driver_interaction)}")
+            count += len(results)
+            after = (results[-1][7], results[-1][6])
+    finally:
+        db.close()
+
+    print(f"{count} sightings", file=sys.stderr)
+    return 0
+
+
+def cmd_stats(args):
+    db = open_database(args)
+    try:
+        if args.by:
+            rows = db.fetch_breakdown(args.by, args.name)
+        else:
+            statistics = db.fetch_statistics(args.period)
+    finally:
+        db.close()
+
+    if not args.by:
+        for name, value in describe_statistics(statistics):
+            print(f"{name}: {value}")
+        return 0
+
+    # One line per station or class, most sightings first
+    for row in rows:
+        print("\t".join(f"{name}: {value}" for name, value in describe_breakdown(args.by, row)))
+    return 0
+
+
+def cmd_leaders(args):
+    db = open_database(args)
+    try:
+        boards = [(board, db.leaderboard(board, args.limit)) for board in args.boards or LEADERBOARDS]
+    finally:
+        db.close()
+
+    titles = dict(LEADERBOARD_LABELS)
+    for board, rows in boards:
+        print(titles[board])
+        for line in describe_leaderboard(board, rows):
+            print("  " + line)
+    return 0
+
+
+def cmd_roster(args):
+    db = open_database(args)
+    try:
+        if args.load:
+            try:
+                count = roster.load_roster_file(db, args.load, force=True)
+            except (OSError, ValueError) as error:
+                print(f"error: {error}", file=sys.stderr)
+                return 2
+            print(f"Loaded {count} units from {args.load}")
+        if args.missing:
+            if not args.train_class:
+                print("error: --missing needs --class", file=sys.stderr)
+                return 2
+            missing = db.missing_units(args.train_class)
+        completion = db.roster_completion(args.train_class)
+    finally:
+        db.close()
+
+    for train_class, seen, units in completion:
+        print(roster.format_completion(train_class, seen, units))
+    if args.missing:
+        for number in missing:
+            print("  " + number)
+    return 0
+
+
+def cmd_achievements(args):
+    db = open_database(args)
+    try:
+        unlocked = db.fetch_unlocked_achievements()
+    finally:
+        db.close()
+
+    for achievement_id, title, unlocked_at, full_log_id in unlocked:
+        print(describe_unlock(title, unlocked_at))
+    return 0
+
+
+def cmd_import(args):
+    return importer.run(args)
+
+
+def cmd_export(args):
+    return exporter.run(args)
+
+
+def cmd_rebuild(args):
+    db = open_database(args)
+    try:
+        db.rebuild_aggregates()
+    finally:
+        db.close()
+
+    print("Rebuilt the tallies, totals, rollups, leaderboards, roster progress and search index from FullLog")
+    return 0
+
+
+def add_db_argument(parser):
+    parser.add_argument("--db", default=DB_PATH, help="database file (default: %(default)s)")
+
+
+def add_filter_arguments(parser):
+    parser.add_argument("--livery", action="store_true", help="special livery")
+    parser.add_argument("--rare", action="store_true", help="rare train")
+    parser.add_argument("--interaction", action="store_true", help="driver interaction")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="trainspotter", description="Train Spotter logbook")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    log = commands.add_parser("log", help="log a sighting")
+    log.add_argument("--station", required=True)
+    log.add_argument("--class", dest="train_class", required=True)
+    log.add_argument("--number", required=True)
+    add_filter_arguments(log)
+    add_db_argument(log)
+    log.set_defaults(func=cmd_log)
+
+    search = commands.add_parser("search", help="search sightings, as on the Search screen")
+    search.add_argument("--class", dest="train_class", help="only these classes, e.g. 66,70")
+    search.add_argument("--text", help="station or number words, matched as prefixes, or as the closest "
+                        "words if none match, newest first; only --class and the flags apply with it")
+    search.add_argument("--station", help="only sightings at this station")
+    search.add_argument("--number", help="only this unit number")
+    search.add_argument("--prefix", action="store_true", help="with --number: numbers starting with it")
+    search.add_argument("--since", help="only sightings from this date")
+    search.add_argument("--until", help="only sightings before this date")
+    search.add_argument("--sort", choices=tuple(ORDERS), default="oldest",
+                        help="oldest or newest logged, earliest or latest seen (default: %(default)s)")
+    search.add_argument("--livery", action=argparse.BooleanOptionalAction, help="only special liveries, or none")
+    search.add_argument("--rare", action=argparse.BooleanOptionalAction, help="only rare trains, or none")
+    search.add_argument("--interaction", action=argparse.BooleanOptionalAction,
+                        help="only driver interactions, or none")
+    search.add_argument("--limit", type=int, help="stop after this many results")
+    add_db_argument(search)
+    search.set_defaults(func=cmd_search)
+
+    history = commands.add_parser("history", help="list the sightings between two dates")
+    history.add_argument("--since", required=True, help="a date such as 2024-05-01 or 01/05/2024")
+    history.add_argument("--until", help="end date, not included (default: now)")
+    add_db_argument(history)
+    history.set_defaults(func=cmd_history)
+
+    stats = commands.add_parser("stats", help="show statistics")
+    stats.add_argument("--period", choices=("all",) + PERIODS, default="all")
+    stats.add_argument("--by", choices=tuple(BREAKDOWNS), help="totals for each station or class instead")
+    stats.add_argument("--name", help="with --by: only this station or class")
+    add_db_argument(stats)
+    stats.set_defaults(func=cmd_stats)
+
+    leaders = commands.add_parser("leaders", help="show the leaderboards")
+    leaders.add_argument("--board", dest="boards", action="append", choices=tuple(LEADERBOARDS),
+                         help="only this board; may be repeated (default: all)")
+    leaders.add_argument("--limit", type=int, default=LEADERBOARD_SIZE, help="entries per board (default: %(default)s)")
+    add_db_argument(leaders)
+    leaders.set_defaults(func=cmd_leaders)
+
+    roster_parser = commands.add_parser("roster", help="show how much of each class has been seen")
+    roster_parser.add_argument("--load", metavar="FILE", help="load a roster CSV file with Class and Number columns")
+    roster_parser.add_argument("--class", dest="train_class", help="only this class")
+    roster_parser.add_argument("--missing", action="store_true", help="with --class: list the units not seen yet")
+    add_db_argument(roster_parser)
+    roster_parser.set_defaults(func=cmd_roster)
+
+    achievements = commands.add_parser("achievements", help="list unlocked achievements")
+    add_db_argument(achievements)
+    achievements.set_defaults(func=cmd_achievements)
+
+    import_parser = commands.add_parser("import", help="import CSV or JSON logbooks")
+    importer.add_arguments(import_parser)
+    import_parser.set_defaults(func=cmd_import)
+
+    export = commands.add_parser("export", help="export a table to CSV, JSON Lines or Parquet")
+    exporter.add_arguments(export)
+    export.set_defaults(func=cmd_export)
+
+    rebuild = commands.add_parser("rebuild", help="recompute the tallies, totals, rollups, leaderboards, "
+                                                  "roster progress and search index from FullLog")
+    add_db_argument(rebuild)
+    rebuild.set_defaults(func=cmd_rebuild)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
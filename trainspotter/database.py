@@ -0,0 +1,914 @@
+"""Data access for tp.db.
+
+A single Database object owns one long-lived SQLite connection that every
+screen goes through, instead of each call opening and closing its own.
+"""
+import difflib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from . import achievements
+from .cache import PageCache
+from .migrations import MIGRATIONS, SCHEMA_VERSION
+from .query import RESULT_COLUMNS, SightingQuery, next_prefix, split_classes
+from .roster import describe_cop, has_bit, new_bitmap, positions, set_bit
+
+DB_PATH = "tp.db"
+
+logger = logging.getLogger(__name__)
+
+# Connection tuning, applied once when the connection is opened
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -8000",  # 8 MB page cache
+    "PRAGMA mmap_size = 67108864",  # 64 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Number of compiled statements kept per connection
+STATEMENT_CACHE_SIZE = 256
+
+# Number of search results fetched at a time
+SEARCH_PAGE_SIZE = 200
+
+# Number of rows fetched at a time when streaming a whole table
+STREAM_BATCH_SIZE = 5000
+
+# Periods the statistics can be narrowed down to, besides "all"
+PERIODS = ("today", "week", "month", "year")
+
+# Leaderboards: name -> query for the top N. Each one reads the first N
+# entries of the index on the count it is ranked by
+LEADERBOARDS = {
+    # (Class, Number, Quantity) of the most seen units
+    "units": "SELECT Class, Number, Quantity FROM Basic ORDER BY Quantity DESC LIMIT ?",
+    # (Station, Sightings) of the most visited stations
+    "stations": """
+        SELECT Station.Name, StationStats.Sightings FROM StationStats
+        JOIN Station ON Station.ID = StationStats.StationID
+        ORDER BY StationStats.Sightings DESC LIMIT ?
+    """,
+    # (Class, Units) of the classes with the most distinct units seen
+    "classes": "SELECT Class, Units FROM ClassStats ORDER BY Units DESC LIMIT ?",
+    # (Day, Sightings) of the busiest days, in local time
+    "days": "SELECT Day, Sightings FROM DayStats ORDER BY Sightings DESC LIMIT ?",
+}
+
+# The FullLog flag counted by each achievement metric that counts sightings,
+# or None for all of them
+SIGHTING_METRICS = {
+    "train_count": None,
+    "special_livery": "SpecialLivery",
+    "rare": "Rare",
+    "driver_interaction": "DriverInteraction",
+}
+
+# The tallies a train reaches to unlock a "same train" achievement
+SAME_TRAIN_THRESHOLDS = frozenset(threshold for category in achievements.CATEGORIES
+                                  if category.metric == "max_quantity" for threshold in category.thresholds)
+
+# Number of entries on a leaderboard
+LEADERBOARD_SIZE = 10
+
+# When a text search finds nothing, each word may also match up to
+# FUZZY_MATCHES words of the index at least this similar to it (a difflib
+# ratio)
+FUZZY_MATCHES = 3
+FUZZY_CUTOFF = 0.75
+
+# Statistics breakdowns: name -> (source, name column). Each row is the
+# name and its Sightings, Units, SpecialLivery, Rare and DriverInteraction
+BREAKDOWNS = {
+    "station": ("StationStats JOIN Station ON Station.ID = StationStats.StationID", "Station.Name"),
+    "class": ("ClassStats", "ClassStats.Class"),
+}
+
+
+class Database:
+    def __init__(self, path=DB_PATH, debug=None):
+        self.path = path
+        # In debug mode the query plan of every statement is logged, and any
+        # plan that falls back to a full table scan is logged as a warning.
+        # TRAINSPOTTER_DEBUG_SQL=1 turns it on without touching the code
+        if debug is None:
+            debug = os.environ.get("TRAINSPOTTER_DEBUG_SQL") == "1"
+        self.debug = debug
+        # The connection may be used from background threads, so access to it
+        # is serialised with a lock rather than tied to the creating thread
+        self.conn = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        self.lock = threading.RLock()
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+
+        # Statistics snapshot, dropped whenever the log is written to
+        self.statistics = None
+
+        # Recently fetched search pages, made stale by every write
+        self.search_cache = PageCache()
+
+        # Whether FullLogSearch exists; checked again after a migration
+        self.fts = self._schema_has(self.conn.cursor(), "table", "FullLogSearch")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _execute(self, cursor, sql, params=()):
+        if self.debug and not sql.lstrip().upper().startswith(("CREATE", "PRAGMA")):
+            self.explain(sql, params)
+        cursor.execute(sql, params)
+        return cursor
+
+    def _executemany(self, cursor, sql, rows):
+        if self.debug:
+            self.explain(sql, [None] * sql.count("?"))
+        cursor.executemany(sql, rows)
+        return cursor
+
+    def explain(self, sql, params=()):
+        plan = self.conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        details = [row[3] for row in plan]
+        query = " ".join(sql.split())
+        # Subquery results and the schema table are small, so scanning them is fine
+        small = {"sqlite_master"}
+        for detail in details:
+            if detail.startswith(("MATERIALIZE ", "CO-ROUTINE ")):
+                small.add(detail.split()[1])
+        for detail in details:
+            # "SCAN FullLog" reads every row, whereas "SCAN FullLog USING
+            # COVERING INDEX ..." only walks an index, e.g. a partial one
+            if detail.startswith("SCAN ") and "INDEX" not in detail and detail.split()[1] not in small:
+                logger.warning("Full scan (%s) in query: %s", detail, query)
+        logger.debug("Query plan for %s: %s", query, "; ".join(details))
+        return details
+
+    def _schema_has(self, cursor, kind, name):
+        self._execute(cursor, "SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?", (kind, name))
+        return cursor.fetchone() is not None
+
+    @contextmanager
+    def transaction(self):
+        # An explicit transaction, so schema changes are rolled back along
+        # with everything else if a step fails
+        with self.lock, self.conn:
+            self.conn.execute("BEGIN")
+            yield self.conn.cursor()
+
+    def schema_version(self):
+        with self.lock:
+            return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def needs_migration(self):
+        return self.schema_version() < SCHEMA_VERSION
+
+    def migrate(self):
+        # Bring the schema up to SCHEMA_VERSION, one migration at a time.
+        # This is a generator yielding (description, done, total) as the
+        # migrations go, so the app can run it on the worker and show how
+        # far it has got; total is None until a migration knows its size
+        version = self.schema_version()
+        if version > SCHEMA_VERSION:
+            logger.warning("%s has schema version %d, newer than this app's %d", self.path, version, SCHEMA_VERSION)
+        for target, description, migration in MIGRATIONS:
+            if target <= version:
+                continue
+            logger.info("Migrating %s to schema version %d: %s", self.path, target, description)
+            yield description, 0, None
+            for done, total in migration(self) or ():
+                yield description, done, total
+
+        with self.lock:
+            self.fts = self._schema_has(self.conn.cursor(), "table", "FullLogSearch")
+            self._changed()
+
+    def _changed(self):
+        # Called with the lock held whenever the log is written to, so the
+        # statistics are read again and the cached search pages go stale
+        self.statistics = None
+        self.search_cache.bump()
+
+    def create_tables(self):
+        # Create or upgrade the schema in one go
+        for _ in self.migrate():
+            pass
+
+    def _station_id(self, cursor, station):
+        # The ID of a station, adding it the first time it is seen. A blank
+        # station is stored as NULL
+        if not station:
+            return None
+        self._execute(cursor, "INSERT OR IGNORE INTO Station (Name) VALUES (?)", (station,))
+        return self._execute(cursor, "SELECT ID FROM Station WHERE Name = ?", (station,)).fetchone()[0]
+
+    def insert_log(self, station, train_class, train_number, special_livery, rare, driver_interaction):
+        # The flags are booleans. The sighting is timestamped with the
+        # current time. Returns the titles of any achievements unlocked and
+        # the notice of a new cop, if it is one
+        special_livery, rare, driver_interaction = bool(special_livery), bool(rare), bool(driver_interaction)
+        with self.lock, self.conn:
+            self._changed()
+            cursor = self.conn.cursor()
+
+            # Insert into FullLog table
+            self._execute(cursor, """
+                INSERT INTO FullLog (DateTime, StationID, Class, Number, SpecialLivery, Rare, DriverInteraction)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (int(time.time()), self._station_id(cursor, station), train_class, train_number,
+                  special_livery, rare, driver_interaction))
+            full_log_id = cursor.lastrowid
+
+            # Add one to the tally for this train, creating it on first sighting
+            self._execute(cursor, """
+                INSERT INTO Basic (Class, Number, Quantity)
+                VALUES (?, ?, 1)
+                ON CONFLICT (Class, Number) DO UPDATE SET Quantity = Quantity + 1
+            """, (train_class, train_number))
+
+            # Update the Total table by the flags of this sighting only, so the
+            # cost of an insert doesn't grow with the size of FullLog
+            self._execute(cursor, """
+                UPDATE Total SET
+                SpecialLivery = SpecialLivery + ?,
+                Rare = Rare + ?,
+                DriverInteraction = DriverInteraction + ?,
+                Trains = Trains + 1
+                WHERE ID = 1
+            """, (special_livery, rare, driver_interaction))
+
+            # Record any achievement this sighting unlocks. Every counter only
+            # moves by one here, so comparing it with its value before the
+            # insert finds the thresholds crossed. For the "same train"
+            # achievements it's this train's tally that moved; another train
+            # may already have passed the threshold, which the UNIQUE
+            # constraint takes care of
+            after = self._achievement_snapshot(cursor)
+            self._execute(cursor, """
+                SELECT Quantity FROM Basic WHERE Class = ? AND Number = ?
+            """, (train_class, train_number))
+            after["max_quantity"] = cursor.fetchone()[0]
+            before = {
+                "train_count": after["train_count"] - 1,
+                "special_livery": after["special_livery"] - special_livery,
+                "rare": after["rare"] - rare,
+                "driver_interaction": after["driver_interaction"] - driver_interaction,
+                "max_quantity": after["max_quantity"] - 1,
+            }
+            self._roll_up(cursor, full_log_id)
+            self._count_leaders(cursor, full_log_id)
+            titles = self._record_unlocks(cursor, achievements.crossed(before, after), full_log_id)
+
+            # The first sighting of a unit on the roster is a new cop
+            cops = []
+            if after["max_quantity"] == 1:
+                cop = self._mark_seen(cursor, train_class, train_number)
+                if cop is not None:
+                    cops.append(describe_cop(train_class, train_number, *cop))
+            return titles, cops
+
+    def insert_logs(self, rows, journal=None):
+        # Insert many sightings in a single transaction. rows is any iterable
+        # of (DateTime, Station, Class, Number, SpecialLivery, Rare,
+        # DriverInteraction) tuples, with DateTime a Unix timestamp or None
+        # and the flags booleans. It is consumed lazily, so it can stream
+        # from a file. Basic and Total are tallied in memory on the way
+        # through and written once at the end. journal is an optional
+        # (journal ID, sequence number) marking how much of a rapid-entry
+        # journal these rows complete, saved in the same transaction.
+        # Returns the number of rows inserted, the titles of any
+        # achievements unlocked and the notices of any new cops
+        basic = Counter()
+        totals = Counter()
+        station_ids = {}
+        # Each unit's tally before the batch, and the position in the batch
+        # of the sighting that first took the highest tally of any unit to
+        # each "same train" threshold
+        quantities = {}
+        reached = {}
+
+        def tally(cursor, rows):
+            top = before["max_quantity"]
+            for position, (date_time, station, train_class, train_number,
+                           special_livery, rare, driver_interaction) in enumerate(rows):
+                if station not in station_ids:
+                    station_ids[station] = self._station_id(cursor, station)
+                special_livery, rare, driver_interaction = bool(special_livery), bool(rare), bool(driver_interaction)
+                unit = train_class, train_number
+                if unit not in quantities:
+                    row = self._execute(cursor, """
+                        SELECT Quantity FROM Basic WHERE Class = ? AND Number = ?
+                    """, unit).fetchone()
+                    quantities[unit] = row[0] if row is not None else 0
+                basic[unit] += 1
+                # Every sighting moves one tally by one, so the highest tally
+                # passes each value in turn
+                if quantities[unit] + basic[unit] > top:
+                    top += 1
+                    if top in SAME_TRAIN_THRESHOLDS:
+                        reached[top] = position
+                totals["special_livery"] += special_livery
+                totals["rare"] += rare
+                totals["driver_interaction"] += driver_interaction
+                totals["trains"] += 1
+                yield (date_time, station_ids[station], train_class, train_number,
+                       special_livery, rare, driver_interaction)
+
+        with self.lock, self.conn:
+            self._changed()
+            cursor = self.conn.cursor()
+            before = self._achievement_snapshot(cursor)
+            first_id = self._execute(cursor, "SELECT IFNULL(MAX(ID), 0) + 1 FROM FullLog").fetchone()[0]
+
+            # New stations are looked up through a second cursor while the
+            # rows stream in
+            self._executemany(cursor, """
+                INSERT INTO FullLog (DateTime, StationID, Class, Number, SpecialLivery, Rare, DriverInteraction)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, tally(self.conn.cursor(), rows))
+
+            self._executemany(cursor, """
+                INSERT INTO Basic (Class, Number, Quantity)
+                VALUES (?, ?, ?)
+                ON CONFLICT (Class, Number) DO UPDATE SET Quantity = Quantity + excluded.Quantity
+            """, ((train_class, train_number, quantity) for (train_class, train_number), quantity in basic.items()))
+
+            self._execute(cursor, """
+                UPDATE Total SET
+                SpecialLivery = SpecialLivery + ?,
+                Rare = Rare + ?,
+                DriverInteraction = DriverInteraction + ?,
+                Trains = Trains + ?
+                WHERE ID = 1
+            """, (totals["special_livery"], totals["rare"], totals["driver_interaction"], totals["trains"]))
+            self._roll_up(cursor, first_id)
+            self._count_leaders(cursor, first_id)
+
+            # Marking a unit that was already seen leaves it as it is, so
+            # every unit in the batch on a roster class is simply marked, and
+            # the ones marked for the first time are new cops
+            roster_classes = {row[0] for row in self._execute(cursor, "SELECT Class FROM RosterClass")}
+            cops = []
+            for train_class, train_number in basic:
+                if train_class in roster_classes:
+                    cop = self._mark_seen(cursor, train_class, train_number)
+                    if cop is not None:
+                        cops.append(describe_cop(train_class, train_number, *cop))
+
+            # Each achievement unlocked by the batch is recorded with the
+            # sighting in it that crossed the threshold
+            after = self._achievement_snapshot(cursor)
+            unlocked = []
+            for unlock in achievements.crossed(before, after):
+                full_log_id = self._unlocking_sighting(cursor, unlock, before, first_id, reached)
+                unlocked += self._record_unlocks(cursor, [unlock], full_log_id, unlocked_at=int(time.time()))
+
+            if journal is not None:
+                self._execute(cursor, """
+                    INSERT INTO JournalMarks (Journal, Sequence) VALUES (?, ?)
+                    ON CONFLICT (Journal) DO UPDATE SET Sequence = MAX(Sequence, excluded.Sequence)
+                """, journal)
+
+        return totals["trains"], unlocked, cops
+
+    def _unlocking_sighting(self, cursor, unlock, before, first_id, reached):
+        # The ID of the sighting from first_id onwards that crossed the
+        # threshold of an unlock, given the snapshot from before them and
+        # the positions of the sightings that reached each "same train"
+        # threshold
+        category, threshold, title = unlock
+        metric = achievements.METRICS[category]
+        if metric in SIGHTING_METRICS:
+            # The (threshold - before)th sighting counted by the metric
+            column = SIGHTING_METRICS[metric]
+            position = threshold - before[metric] - 1
+        else:
+            column, position = None, reached[threshold]
+        flag = f" AND {column} = 1" if column else ""
+        row = self._execute(cursor, f"""
+            SELECT ID FROM FullLog WHERE ID >= ?{flag}
+            ORDER BY ID LIMIT 1 OFFSET ?
+        """, (first_id, position)).fetchone()
+        return row[0] if row is not None else None
+
+    def journal_sequence(self, journal):
+        # The last sequence number of a rapid-entry journal already in FullLog
+        with self.lock:
+            row = self._execute(self.conn.cursor(), """
+                SELECT Sequence FROM JournalMarks WHERE Journal = ?
+            """, (journal,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def _roll_up(self, cursor, first_id=0, last_id=None):
+        # Add the sightings with IDs from first_id to last_id (or onwards) to
+        # the daily and monthly rollups, grouped in SQL so a bulk insert
+        # costs one statement each
+        id_range = "ID >= ?" if last_id is None else "ID BETWEEN ? AND ?"
+        params = (first_id,) if last_id is None else (first_id, last_id)
+        for table, column, date_format in (("DailyRollup", "Day", "%Y-%m-%d"), ("MonthlyRollup", "Month", "%Y-%m")):
+            self._execute(cursor, f"""
+                INSERT INTO {table} ({column}, Class, StationID, Sightings, SpecialLivery, Rare, DriverInteraction)
+                SELECT strftime('{date_format}', DateTime, 'unixepoch', 'localtime'),
+                       IFNULL(Class, ''), IFNULL(StationID, 0),
+                       COUNT(*), SUM(SpecialLivery), SUM(Rare), SUM(DriverInteraction)
+                FROM FullLog
+                WHERE {id_range} AND DateTime IS NOT NULL
+                GROUP BY 1, 2, 3
+                ON CONFLICT ({column}, Class, StationID) DO UPDATE SET
+                    Sightings = Sightings + excluded.Sightings,
+                    SpecialLivery = SpecialLivery + excluded.SpecialLivery,
+                    Rare = Rare + excluded.Rare,
+                    DriverInteraction = DriverInteraction + excluded.DriverInteraction
+            """, params)
+
+    def _count_leaders(self, cursor, first_id=0, last_id=None):
+        # Add the sightings with IDs from first_id to last_id (or onwards) to
+        # the per-station, per-class and per-day totals. A unit is new to a
+        # station or class when its whole tally in StationUnits or Basic
+        # comes from these sightings, so Basic must already include them
+        id_range = "ID >= ?" if last_id is None else "ID BETWEEN ? AND ?"
+        params = (first_id,) if last_id is None else (first_id, last_id)
+        # NOT INDEXED keeps the planner reading the ID range, rather than
+        # walking the whole of idx_fulllog_station or idx_fulllog_class to
+        # save sorting the groups
+        self._execute(cursor, f"""
+            INSERT INTO StationUnits (StationID, Class, Number, Sightings)
+            SELECT StationID, Class, Number, COUNT(*) FROM FullLog NOT INDEXED
+            WHERE {id_range} AND StationID IS NOT NULL AND Class IS NOT NULL AND Number IS NOT NULL
+            GROUP BY StationID, Class, Number
+            ON CONFLICT (StationID, Class, Number) DO UPDATE SET Sightings = Sightings + excluded.Sightings
+        """, params)
+        self._execute(cursor, f"""
+            INSERT INTO StationStats (StationID, Sightings, Units, SpecialLivery, Rare, DriverInteraction)
+            SELECT Seen.StationID, SUM(Seen.Sightings), TOTAL(StationUnits.Sightings = Seen.Sightings),
+                   SUM(Seen.SpecialLivery), SUM(Seen.Rare), SUM(Seen.DriverInteraction)
+            FROM (
+                SELECT StationID, Class, Number, COUNT(*) AS Sightings,
+                       SUM(SpecialLivery) AS SpecialLivery, SUM(Rare) AS Rare,
+                       SUM(DriverInteraction) AS DriverInteraction
+                FROM FullLog NOT INDEXED
+                WHERE {id_range} AND StationID IS NOT NULL
+                GROUP BY StationID, Class, Number
+            ) AS Seen
+            LEFT JOIN StationUnits ON StationUnits.StationID = Seen.StationID
+                AND StationUnits.Class = Seen.Class AND StationUnits.Number = Seen.Number
+            GROUP BY Seen.StationID
+            ON CONFLICT (StationID) DO UPDATE SET
+                Sightings = Sightings + excluded.Sightings,
+                Units = Units + excluded.Units,
+                SpecialLivery = SpecialLivery + excluded.SpecialLivery,
+                Rare = Rare + excluded.Rare,
+                DriverInteraction = DriverInteraction + excluded.DriverInteraction
+        """, params)
+        self._execute(cursor, f"""
+            INSERT INTO ClassStats (Class, Sightings, Units, SpecialLivery, Rare, DriverInteraction)
+            SELECT Seen.Class, SUM(Seen.Sightings), SUM(Basic.Quantity = Seen.Sightings),
+                   SUM(Seen.SpecialLivery), SUM(Seen.Rare), SUM(Seen.DriverInteraction)
+            FROM (
+                SELECT Class, Number, COUNT(*) AS Sightings,
+                       SUM(SpecialLivery) AS SpecialLivery, SUM(Rare) AS Rare,
+                       SUM(DriverInteraction) AS DriverInteraction
+                FROM FullLog NOT INDEXED
+                WHERE {id_range} AND Class IS NOT NULL
+                GROUP BY Class, Number
+            ) AS Seen
+            JOIN Basic ON Basic.Class = Seen.Class AND Basic.Number IS Seen.Number
+            GROUP BY Seen.Class
+            ON CONFLICT (Class) DO UPDATE SET
+                Sightings = Sightings + excluded.Sightings,
+                Units = Units + excluded.Units,
+                SpecialLivery = SpecialLivery + excluded.SpecialLivery,
+                Rare = Rare + excluded.Rare,
+                DriverInteraction = DriverInteraction + excluded.DriverInteraction
+        """, params)
+        self._execute(cursor, f"""
+            INSERT INTO DayStats (Day, Sightings)
+            SELECT strftime('%Y-%m-%d', DateTime, 'unixepoch', 'localtime'), COUNT(*) FROM FullLog
+            WHERE {id_range} AND DateTime IS NOT NULL
+            GROUP BY 1
+            ON CONFLICT (Day) DO UPDATE SET Sightings = Sightings + excluded.Sightings
+        """, params)
+
+    def rebuild_aggregates(self):
+        # Recompute Basic, Total, the rollups, the leaderboard and breakdown
+        # totals and the roster bitmaps from FullLog, and rebuild the search
+        # index, to repair any drift in what is maintained incrementally
+        with self.lock, self.conn:
+            self._changed()
+            cursor = self.conn.cursor()
+
+            self._execute(cursor, "DELETE FROM Basic")
+            self._execute(cursor, """
+                INSERT INTO Basic (Class, Number, Quantity)
+                SELECT Class, Number, COUNT(*) FROM FullLog
+                GROUP BY Class, Number
+            """)
+
+            self._execute(cursor, """
+                UPDATE Total SET
+                SpecialLivery = (SELECT COUNT(*) FROM FullLog WHERE SpecialLivery = 1),
+                Rare = (SELECT COUNT(*) FROM FullLog WHERE Rare = 1),
+                DriverInteraction = (SELECT COUNT(*) FROM FullLog WHERE DriverInteraction = 1),
+                Trains = (SELECT COUNT(*) FROM FullLog)
+                WHERE ID = 1
+            """)
+
+            for table in ("DailyRollup", "MonthlyRollup", "StationUnits", "StationStats", "ClassStats", "DayStats"):
+                self._execute(cursor, f"DELETE FROM {table}")
+            self._roll_up(cursor)
+            self._count_leaders(cursor)
+
+            for (train_class,) in self._execute(cursor, "SELECT Class FROM RosterClass").fetchall():
+                self._fill_roster_bitmap(cursor, train_class)
+
+            # Fill in any achievement the repaired counts have reached
+            self._record_unlocks(cursor, achievements.crossed({}, self._achievement_snapshot(cursor)))
+
+            if self.fts:
+                self._execute(cursor, "INSERT INTO FullLogSearch (FullLogSearch) VALUES ('rebuild')")
+
+    def _mark_seen(self, cursor, train_class, train_number):
+        # Set the roster bit of a unit. Returns how many units of its class
+        # have been seen and how many there are if this is the first time,
+        # or None if it had been seen already or isn't on the roster
+        row = self._execute(cursor, """
+            SELECT Roster.Position, RosterClass.Bitmap, RosterClass.Seen, RosterClass.Units
+            FROM Roster JOIN RosterClass ON RosterClass.Class = Roster.Class
+            WHERE Roster.Class = ? AND Roster.Number = ?
+        """, (train_class, train_number)).fetchone()
+        if row is None:
+            return None
+        position, bitmap, seen, units = row
+        bitmap = bytearray(bitmap)
+        if has_bit(bitmap, position):
+            return None
+        set_bit(bitmap, position)
+        self._execute(cursor, """
+            UPDATE RosterClass SET Bitmap = ?, Seen = Seen + 1 WHERE Class = ?
+        """, (bytes(bitmap), train_class))
+        return seen + 1, units
+
+    def _fill_roster_bitmap(self, cursor, train_class):
+        # Work out the bitmap of a roster class from Basic, from scratch
+        units = self._execute(cursor, "SELECT COUNT(*) FROM Roster WHERE Class = ?", (train_class,)).fetchone()[0]
+        bitmap = new_bitmap(units)
+        self._execute(cursor, """
+            SELECT Roster.Position FROM Roster
+            JOIN Basic ON Basic.Class = Roster.Class AND Basic.Number = Roster.Number
+            WHERE Roster.Class = ?
+        """, (train_class,))
+        seen = 0
+        for (position,) in cursor.fetchall():
+            set_bit(bitmap, position)
+            seen += 1
+        self._execute(cursor, """
+            INSERT INTO RosterClass (Class, Units, Seen, Bitmap) VALUES (?, ?, ?, ?)
+            ON CONFLICT (Class) DO UPDATE SET
+                Units = excluded.Units, Seen = excluded.Seen, Bitmap = excluded.Bitmap
+        """, (train_class, units, seen, bytes(bitmap)))
+
+    def load_roster(self, roster, source=None):
+        # Replace the roster of each class in roster, {class: unit numbers},
+        # numbering the units in the order given, and mark the units already
+        # seen. source is an optional (path, modification time) of the file
+        # it came from. Returns the number of units loaded
+        count = 0
+        with self.lock, self.conn:
+            cursor = self.conn.cursor()
+            for train_class, numbers in roster.items():
+                numbers = list(dict.fromkeys(numbers))
+                self._execute(cursor, "DELETE FROM Roster WHERE Class = ?", (train_class,))
+                self._executemany(cursor, """
+                    INSERT INTO Roster (Class, Number, Position) VALUES (?, ?, ?)
+                """, ((train_class, number, position) for position, number in enumerate(numbers)))
+                self._fill_roster_bitmap(cursor, train_class)
+                count += len(numbers)
+            if source is not None:
+                self._execute(cursor, """
+                    INSERT INTO RosterSource (Path, Modified) VALUES (?, ?)
+                    ON CONFLICT (Path) DO UPDATE SET Modified = excluded.Modified
+                """, source)
+        return count
+
+    def roster_sources(self):
+        # The paths of the roster files loaded so far
+        with self.lock:
+            return [path for (path,) in self._execute(self.conn.cursor(), """
+                SELECT Path FROM RosterSource ORDER BY Path
+            """)]
+
+    def roster_source(self, path):
+        # The modification time of the roster file when it was last loaded
+        with self.lock:
+            row = self._execute(self.conn.cursor(), """
+                SELECT Modified FROM RosterSource WHERE Path = ?
+            """, (path,)).fetchone()
+        return row[0] if row is not None else None
+
+    def roster_completion(self, train_class=None):
+        # (Class, Seen, Units) for every class on the roster, or just one
+        query = "SELECT Class, Seen, Units FROM RosterClass"
+        params = ()
+        if train_class is not None:
+            query += " WHERE Class = ?"
+            params = (train_class,)
+        with self.lock:
+            return self._execute(self.conn.cursor(), query + " ORDER BY Class", params).fetchall()
+
+    def missing_units(self, train_class):
+        # The units of a roster class that haven't been seen, in roster order
+        with self.lock:
+            cursor = self.conn.cursor()
+            row = self._execute(cursor, """
+                SELECT Bitmap, Units FROM RosterClass WHERE Class = ?
+            """, (train_class,)).fetchone()
+            if row is None:
+                return []
+            numbers = [number for (number,) in self._execute(cursor, """
+                SELECT Number FROM Roster WHERE Class = ? ORDER BY Position
+            """, (train_class,))]
+        return [numbers[position] for position in positions(row[0], row[1], seen=False)]
+
+    def search_query(self, train_class, has_livery=None, is_rare=None, has_interaction=None, query=None):
+        # A SightingQuery for the Search screen filters. train_class is one
+        # class, several separated by commas or spaces, or a list of them;
+        # each flag is True, False or None for either
+        if isinstance(train_class, str):
+            train_class = split_classes(train_class)
+        query = query or SightingQuery()
+        return query.classes(*(train_class or ())).flags(has_livery, is_rare, has_interaction)
+
+    def search_logs(self, train_class, has_livery=None, is_rare=None, has_interaction=None,
+                    after_id=0, limit=SEARCH_PAGE_SIZE):
+        # Return one page of matches with an ID greater than after_id. Pages
+        # are keyed on the last ID seen rather than an OFFSET, so fetching a
+        # later page doesn't have to step over all the rows before it
+        query = self.search_query(train_class, has_livery, is_rare, has_interaction)
+        return self.find(query.page(after_id or None), limit)
+
+    def text_search(self, text, train_class=None, has_livery=None, is_rare=None, has_interaction=None,
+                    before_id=None, limit=SEARCH_PAGE_SIZE):
+        # Search stations, classes and numbers. Every word is matched as a
+        # prefix, so "crewe 66" finds class 66s seen at Crewe and "43" finds
+        # numbers starting with 43. Classes and flags narrow the results
+        # further. Matches come newest first, a page at a time below before_id; the
+        # full-text index hands them over in that order, whereas ranking by
+        # bm25() would have to score every match of a common station first.
+        # When nothing matches at all, each word also matches the words in the
+        # index closest to it, so "crwe" still finds Crewe
+        terms = [term.strip('"*') for term in text.split()]
+        terms = [term for term in terms if term]
+        if not terms:
+            return []
+
+        filters = (train_class, has_livery, is_rare, has_interaction)
+        query = self._text_query([[term] for term in terms], *filters)
+        rows = self.find(query.copy().page(before_id), limit)
+        # An empty page may only be the end of the matches, so the fuzzy
+        # search is used only if there are none
+        if rows or not self.fts or self.find(query, 1):
+            return rows
+        alternatives = self._close_terms(terms)
+        if alternatives is None:
+            return rows
+        return self.find(self._text_query(alternatives, *filters).page(before_id), limit)
+
+    def _text_query(self, alternatives, train_class, has_livery, is_rare, has_interaction):
+        # The SightingQuery matching every word, where each word is a list of
+        # alternatives any of which will do
+        if self.fts:
+            # Each word is quoted so punctuation in a station name can't be
+            # read as query syntax. Ordering and paging on the index's own
+            # rowid lets it return matches newest first without sorting them
+            query = SightingQuery(
+                "FullLogSearch JOIN Sightings ON Sightings.ID = FullLogSearch.rowid", qualifier="Sightings."
+            ).order("newest", id_column="FullLogSearch.rowid")
+            query.where("FullLogSearch MATCH ?", " AND ".join(
+                "(" + " OR ".join('"' + word.replace('"', '""') + '"*' for word in words) + ")"
+                for words in alternatives
+            ))
+        else:
+            query = SightingQuery().order("newest")
+            for words in alternatives:
+                query.where("(" + " OR ".join(["Station LIKE ? OR Class LIKE ? OR Number LIKE ?"] * len(words)) + ")",
+                            *[word + "%" for word in words for _ in range(3)])
+
+        return self.search_query(train_class, has_livery, is_rare, has_interaction, query)
+
+    def _close_terms(self, terms):
+        # Each search word with the words of the full-text index closest to
+        # it, or None if there are none. Only words starting with the same
+        # character are compared, which is a short range of the index's term
+        # list; a typo in the first character is rare
+        alternatives = []
+        with self.lock:
+            cursor = self.conn.cursor()
+            self._execute(cursor, """
+                CREATE VIRTUAL TABLE IF NOT EXISTS temp.FullLogTerms
+                USING fts5vocab(main, 'FullLogSearch', 'row')
+            """)
+            for term in terms:
+                word = term.lower()
+                close = []
+                if word.isalnum():
+                    self._execute(cursor, """
+                        SELECT term FROM temp.FullLogTerms WHERE term >= ? AND term < ?
+                    """, (word[0], next_prefix(word[0])))
+                    words = [row[0] for row in cursor.fetchall()]
+                    close = difflib.get_close_matches(word, words, FUZZY_MATCHES, FUZZY_CUTOFF)
+                alternatives.append([term] + [match for match in close if match != word])
+        if all(len(words) == 1 for words in alternatives):
+            return None
+        return alternatives
+
+    def find(self, query, limit=SEARCH_PAGE_SIZE, columns=RESULT_COLUMNS):
+        # One page of the results of a SightingQuery, through the page cache
+        sql, params = query.build(columns, limit)
+        return self._cached_page(query.key() + (columns, limit), sql, params)
+
+    def _cached_page(self, key, query, params):
+        # A page of search results from the cache, or from the query when it
+        # isn't cached or a write has made it stale. The lock is held
+        # throughout, so a write can't slip in between reading the page and
+        # caching it under the generation it was read in
+        with self.lock:
+            rows = self.search_cache.get(key)
+            if rows is None:
+                rows = self._execute(self.conn.cursor(), query, params).fetchall()
+                self.search_cache.put(key, rows)
+            return rows
+
+    def sightings_between(self, start, end, after=None, limit=SEARCH_PAGE_SIZE):
+        # One page of the sightings with start <= DateTime < end (Unix
+        # timestamps), oldest first. Pages are keyed on the (DateTime, ID)
+        # of the last row seen, like search_logs
+        query = SightingQuery().since(start).until(end).order("earliest").page(after)
+        return self.find(query, limit, RESULT_COLUMNS + ("DateTime",))
+
+    def column_types(self, table):
+        # Declared type of each column of a table
+        with self.lock:
+            rows = self._execute(self.conn.cursor(), f"PRAGMA table_info({table})").fetchall()
+        return {row[1]: row[2] for row in rows}
+
+    def stream(self, query, params=(), batch_size=STREAM_BATCH_SIZE):
+        # Yield the column names, then the rows of a query in lists of up to
+        # batch_size rows, so a large table is never held in memory at once.
+        # The connection stays locked until the generator is exhausted or closed
+        with self.lock:
+            cursor = self._execute(self.conn.cursor(), query, params)
+            yield [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+    def _achievement_snapshot(self, cursor):
+        # Everything the achievements are measured against, in one query over
+        # the maintained aggregates rather than FullLog
+        self._execute(cursor, """
+            SELECT Trains, SpecialLivery, Rare, DriverInteraction,
+                   (SELECT MAX(Quantity) FROM Basic)
+            FROM Total WHERE ID = 1
+        """)
+        row = cursor.fetchone()
+
+        return {
+            "train_count": row[0],
+            "special_livery": row[1],
+            "rare": row[2],
+            "driver_interaction": row[3],
+            "max_quantity": row[4] or 0,
+        }
+
+    def _record_unlocks(self, cursor, unlocks, full_log_id=None, unlocked_at=None):
+        # Store newly unlocked achievements and return the titles of those
+        # that weren't already recorded
+        if full_log_id is not None:
+            unlocked_at = int(time.time())
+        titles = []
+        for category, threshold, title in unlocks:
+            self._execute(cursor, """
+                INSERT OR IGNORE INTO UnlockedAchievements (Category, Threshold, Title, UnlockedAt, FullLogID)
+                VALUES (?, ?, ?, ?, ?)
+            """, (category, threshold, title, unlocked_at, full_log_id))
+            if cursor.rowcount == 1:
+                titles.append(title)
+        return titles
+
+    def fetch_unlocked_achievements(self, after_id=0):
+        # Unlocked achievements in the order they were unlocked
+        with self.lock:
+            return self._execute(self.conn.cursor(), """
+                SELECT ID, Title, UnlockedAt, FullLogID FROM UnlockedAchievements
+                WHERE ID > ? ORDER BY ID
+            """, (after_id,)).fetchall()
+
+    def fetch_statistics(self, period="all"):
+        # The statistics are kept in memory until the next write, so showing
+        # them again doesn't touch the database. The statistics for one of
+        # PERIODS come from the rollups and are read every time, as "today"
+        # moves on by itself
+        if period != "all":
+            return self._read_period_statistics(period)
+        with self.lock:
+            if self.statistics is None:
+                self.statistics = self._read_statistics()
+            return dict(self.statistics)
+
+    def _read_statistics(self):
+        # All of the statistics in one query over the maintained aggregates;
+        # the most common train is the last entry of the Basic.Quantity index
+        row = self._execute(self.conn.cursor(), """
+            SELECT Total.Trains, Total.SpecialLivery, Total.Rare, Total.DriverInteraction,
+                   Top.Class, Top.Number, Top.Quantity
+            FROM Total
+            LEFT JOIN (
+                SELECT Class, Number, Quantity FROM Basic
+                ORDER BY Quantity DESC LIMIT 1
+            ) AS Top
+            WHERE Total.ID = 1
+        """).fetchone()
+
+        return {
+            "total_trains": row[0],
+            "special_livery": row[1],
+            "rare_trains": row[2],
+            "driver_interaction": row[3],
+            "most_common_train": row[4:] if row[6] is not None else None,
+        }
+
+    def leaderboard(self, board, limit=LEADERBOARD_SIZE):
+        # The top entries of one of LEADERBOARDS, highest first
+        if board not in LEADERBOARDS:
+            raise ValueError(f"Unknown leaderboard: {board}")
+        with self.lock:
+            return self._execute(self.conn.cursor(), LEADERBOARDS[board], (limit,)).fetchall()
+
+    def fetch_breakdown(self, kind, name=None):
+        # The totals of every station or class in BREAKDOWNS, most sightings
+        # first, or of the one called name. They are read straight from the
+        # maintained tables, which hold a row per station or class
+        if kind not in BREAKDOWNS:
+            raise ValueError(f"Unknown breakdown: {kind}")
+        source, name_column = BREAKDOWNS[kind]
+        table = source.split()[0]
+        query = f"""
+            SELECT {name_column}, {table}.Sightings, {table}.Units, {table}.SpecialLivery,
+                   {table}.Rare, {table}.DriverInteraction
+            FROM {source}
+        """
+        params = ()
+        if name is not None:
+            query += f" WHERE {name_column} = ?"
+            params = (name,)
+        query += f" ORDER BY {table}.Sightings DESC"
+        with self.lock:
+            return self._execute(self.conn.cursor(), query, params).fetchall()
+
+    def _read_period_statistics(self, period, today=None):
+        # The same counts as _read_statistics, for the sightings of one of
+        # PERIODS. The rollups hold no unit numbers, so the most common class
+        # takes the place of the most common train
+        today = today or date.today()
+        if period == "today":
+            table, column, start, end = "DailyRollup", "Day", today.isoformat(), today.isoformat()
+        elif period == "week":
+            table, column, start, end = "DailyRollup", "Day", (today - timedelta(days=6)).isoformat(), today.isoformat()
+        elif period == "month":
+            table, column, start, end = "MonthlyRollup", "Month", today.strftime("%Y-%m"), today.strftime("%Y-%m")
+        elif period == "year":
+            table, column, start, end = "MonthlyRollup", "Month", f"{today.year}-01", f"{today.year}-12"
+        else:
+            raise ValueError(f"Unknown period: {period}")
+
+        with self.lock:
+            cursor = self.conn.cursor()
+            row = self._execute(cursor, f"""
+                SELECT IFNULL(SUM(Sightings), 0), IFNULL(SUM(SpecialLivery), 0),
+                       IFNULL(SUM(Rare), 0), IFNULL(SUM(DriverInteraction), 0)
+                FROM {table} WHERE {column} BETWEEN ? AND ?
+            """, (start, end)).fetchone()
+            top = self._execute(cursor, f"""
+                SELECT Class, SUM(Sightings) AS Seen FROM {table}
+                WHERE {column} BETWEEN ? AND ?
+                GROUP BY Class ORDER BY Seen DESC LIMIT 1
+            """, (start, end)).fetchone()
+
+        return {
+            "total_trains": row[0],
+            "special_livery": row[1],
+            "rare_trains": row[2],
+            "driver_interaction": row[3],
+            "most_common_class": top,
+        }
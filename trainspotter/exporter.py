@@ -0,0 +1,159 @@
+"""Export of tp.db tables to CSV, JSON Lines or Parquet.
+
+Rows are streamed from the database in batches and written as they arrive,
+so memory use stays flat however big the log is. CSV and JSON Lines output
+is gzip-compressed when the file name ends in .gz. Parquet output needs
+pyarrow, which is not a dependency of the app itself.
+
+Usage: python -m trainspotter export sightings.csv [--class 66,70 --rare]
+"""
+import argparse
+import csv
+import gzip
+import json
+import sys
+
+from .database import DB_PATH, Database
+from .query import SIGHTING_COLUMNS, SightingQuery
+
+TABLES = ("FullLog", "Basic", "Total")
+FORMATS = ("csv", "jsonl", "parquet")
+
+# FullLog is exported through the Sightings view, with station names rather
+# than their IDs, so an export can be imported again as it is
+SOURCES = {"FullLog": "Sightings"}
+
+
+def export_query(db, table, filters=None):
+    # FullLog can be narrowed down with the same filters as the Search
+    # screen: (train_class, has_livery, is_rare, has_interaction), with
+    # None for any
+    if table not in TABLES:
+        raise ValueError(f"Unknown table: {table}")
+    if table == "FullLog":
+        query = db.search_query(*filters) if filters is not None else SightingQuery()
+        return query.build(SIGHTING_COLUMNS)
+    if filters is not None:
+        raise ValueError("Filters only apply to FullLog")
+    return f"SELECT * FROM {table} ORDER BY ID", ()
+
+
+def open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", newline="", encoding="utf-8")
+    return open(path, "w", newline="", encoding="utf-8")
+
+
+def write_csv(path, columns, batches, types=None):
+    count = 0
+    with open_text(path) as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def write_jsonl(path, columns, batches, types=None):
+    count = 0
+    with open_text(path) as f:
+        for rows in batches:
+            for row in rows:
+                f.write(json.dumps(dict(zip(columns, row))) + "\n")
+            count += len(rows)
+    return count
+
+
+def write_parquet(path, columns, batches, types=None, compression="zstd"):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    # Columns declared INTEGER in SQLite become int64, everything else
+    # nullable text. Each fetched batch is written as one row group
+    types = types or {}
+    schema = pa.schema([
+        (name, pa.int64() if "INT" in types.get(name, "").upper() else pa.string())
+        for name in columns
+    ])
+
+    count = 0
+    with pq.ParquetWriter(path, schema, compression=compression) as writer:
+        for rows in batches:
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    return count
+
+
+WRITERS = {
+    "csv": write_csv,
+    "jsonl": write_jsonl,
+    "parquet": write_parquet,
+}
+
+
+def guess_format(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    extension = name.rsplit(".", 1)[-1].lower()
+    if extension in ("jsonl", "ndjson"):
+        return "jsonl"
+    if extension in FORMATS:
+        return extension
+    return "csv"
+
+
+def export_table(db, path, table="FullLog", output_format=None, filters=None):
+    # Write a table to path and return the number of rows written
+    query, params = export_query(db, table, filters)
+    types = db.column_types(SOURCES.get(table, table))
+    stream = db.stream(query, params)
+    try:
+        columns = next(stream)
+        return WRITERS[output_format or guess_format(path)](path, columns, stream, types)
+    finally:
+        stream.close()
+
+
+def add_arguments(parser):
+    parser.add_argument("output", help="file to write; .gz compresses CSV and JSON Lines")
+    parser.add_argument("--db", default=DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--table", choices=TABLES, default="FullLog")
+    parser.add_argument("--format", choices=FORMATS, help="output format (default: from the file name)")
+    parser.add_argument("--class", dest="train_class", help="only sightings of these classes, e.g. 66,70")
+    parser.add_argument("--livery", action=argparse.BooleanOptionalAction, help="only special liveries, or none")
+    parser.add_argument("--rare", action=argparse.BooleanOptionalAction, help="only rare trains, or none")
+    parser.add_argument("--interaction", action=argparse.BooleanOptionalAction,
+                        help="only driver interactions, or none")
+
+
+def run(args):
+    filters = (args.train_class, args.livery, args.rare, args.interaction)
+    if filters == (None, None, None, None):
+        filters = None
+
+    db = Database(args.db)
+    db.create_tables()  # An older database is upgraded first, for the Sightings view
+    try:
+        count = export_table(db, args.output, args.table, args.format, filters)
+    except (ValueError, RuntimeError) as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+    finally:
+        db.close()
+
+    print(f"Exported {count} rows from {args.table} to {args.output}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the Train Spotter database")
+    add_arguments(parser)
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
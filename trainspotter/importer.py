@@ -0,0 +1,196 @@
+"""Bulk import of historical logbooks into tp.db.
+
+Rows are streamed from CSV or JSON Lines files through a generator
+pipeline (read -> validate -> insert), so memory use doesn't depend on the
+size of the file. A JSON file holding a single array is also accepted, but
+is read into memory in one go.
+
+Columns are matched by name, ignoring case, spaces and underscores:
+Station, Class, Number, SpecialLivery, Rare, DriverInteraction and an
+optional DateTime. Flags accept Yes/No, Y/N, True/False or 1/0. DateTime
+accepts a Unix timestamp, an ISO 8601 date and time or DD/MM/YYYY [HH:MM];
+dates without a time zone are taken as local time.
+
+Usage: python -m trainspotter import logbook.csv [more files...]
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+import time
+
+from .database import DB_PATH, Database
+
+FIELDS = ("DateTime", "Station", "Class", "Number", "SpecialLivery", "Rare", "DriverInteraction")
+REQUIRED = ("Class", "Number")
+FLAGS = ("SpecialLivery", "Rare", "DriverInteraction")
+
+TRUE_VALUES = {"yes", "y", "true", "t", "1"}
+FALSE_VALUES = {"no", "n", "false", "f", "0", ""}
+
+DATE_FORMATS = ("%d/%m/%Y %H:%M", "%d/%m/%Y")
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+        self.unlocked = []
+        self.cops = []
+
+    def skip(self, source, line, message):
+        self.skipped += 1
+        # Keep the first few problems for the summary, but not all of them
+        if len(self.errors) < 20:
+            self.errors.append(f"{source}:{line}: {message}")
+
+
+def normalise_key(key):
+    return key.replace(" ", "").replace("_", "").lower() if key else key
+
+
+KEYS = {normalise_key(field): field for field in FIELDS}
+
+
+def read_rows(path, report):
+    # Yield (line number, dict) pairs from a CSV, JSON Lines or JSON file. A
+    # line of JSON Lines that can't be parsed is skipped like any other bad row
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if extension == ".csv":
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+        elif extension in (".jsonl", ".ndjson"):
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as error:
+                    report.skip(path, line_number, f"not valid JSON: {error.msg}")
+                    continue
+                yield line_number, record
+        elif extension == ".json":
+            for index, record in enumerate(json.load(f), 1):
+                yield index, record
+        else:
+            raise ValueError(f"Unsupported file type: {path}")
+
+
+def parse_flag(value):
+    text = str(value if value is not None else "").strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"not a yes/no value: {value!r}")
+
+
+def parse_datetime(value):
+    # A Unix timestamp, or None when the sighting has no date
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+
+    text = str(value).strip()
+    if text.isdigit():
+        return int(text)
+    try:
+        return int(datetime.datetime.fromisoformat(text).timestamp())
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return int(datetime.datetime.strptime(text, date_format).timestamp())
+        except ValueError:
+            pass
+    raise ValueError(f"not a date: {value!r}")
+
+
+def validate(records, source, report):
+    # Turn raw records into FullLog rows, skipping the ones that can't be used
+    for line, record in records:
+        if not isinstance(record, dict):
+            report.skip(source, line, "not a record")
+            continue
+
+        values = {}
+        for key, value in record.items():
+            field = KEYS.get(normalise_key(key))
+            if field is not None:
+                values[field] = value.strip() if isinstance(value, str) else value
+
+        missing = [field for field in REQUIRED if values.get(field) in (None, "")]
+        if missing:
+            report.skip(source, line, "missing " + ", ".join(missing))
+            continue
+
+        try:
+            flags = [parse_flag(values.get(field)) for field in FLAGS]
+            date_time = parse_datetime(values.get("DateTime"))
+        except ValueError as error:
+            report.skip(source, line, str(error))
+            continue
+
+        yield (
+            date_time,
+            values.get("Station"),
+            str(values["Class"]),
+            str(values["Number"]),
+            *flags,
+        )
+
+
+def import_files(db, paths, report=None):
+    report = report or ImportReport()
+    for path in paths:
+        count, unlocked, cops = db.insert_logs(validate(read_rows(path, report), path, report))
+        report.imported += count
+        report.unlocked.extend(unlocked)
+        report.cops.extend(cops)
+    return report
+
+
+def add_arguments(parser):
+    parser.add_argument("files", nargs="+", help="CSV, JSON Lines or JSON files to import")
+    parser.add_argument("--db", default=DB_PATH, help="database file (default: %(default)s)")
+
+
+def run(args):
+    db = Database(args.db)
+    db.create_tables()
+    started = time.perf_counter()
+    try:
+        report = import_files(db, args.files)
+    except (ValueError, OSError) as error:
+        # An unreadable file or one of an unknown type; files before it
+        # have already been imported
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - started
+
+    print(f"Imported {report.imported} sightings in {elapsed:.1f}s, skipped {report.skipped}")
+    for error in report.errors:
+        print("  " + error, file=sys.stderr)
+    for title in report.unlocked:
+        print("Achievement unlocked: " + title)
+    for cop in report.cops:
+        print(cop)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import logbooks into the Train Spotter database")
+    add_arguments(parser)
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
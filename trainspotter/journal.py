@@ -0,0 +1,127 @@
+"""Crash-safe queue of sightings logged in rapid-entry mode.
+
+Sightings are held in memory and written to FullLog in batches. Each one
+is appended to a JSON Lines journal and synced to disk as it is queued, so
+nothing is lost if the app is killed before the batch is saved. Every
+entry has a sequence number, and the last one saved is stored in the
+database in the same transaction as the batch; entries at or below it are
+skipped when the journal is replayed, so a crash between saving a batch
+and trimming the journal doesn't log those sightings twice.
+
+The first line of the journal names it and records the last sequence
+number trimmed from it:
+
+    {"journal": "5f0c...", "flushed": 12}
+    {"sequence": 13, "row": [1718000000, "Crewe", "66", "66001", false, true, false]}
+"""
+import json
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PATH = "tp-queue.jsonl"
+
+
+class SightingQueue:
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self.journal = None
+        self.flushed = 0
+        # (sequence number, FullLog row) pairs waiting to be saved
+        self.pending = []
+        self.load()
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def load(self):
+        if not os.path.exists(self.path):
+            self.journal = uuid.uuid4().hex
+            self.rewrite()
+            return
+
+        with open(self.path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        header = json.loads(lines[0])
+        self.journal = header["journal"]
+        self.flushed = header["flushed"]
+        for number, line in enumerate(lines[1:], 2):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Only the last line can be cut short, by a crash while it
+                # was being written
+                logger.warning("Skipping unreadable line %d of %s", number, self.path)
+                continue
+            if entry["sequence"] > self.flushed:
+                self.pending.append((entry["sequence"], tuple(entry["row"])))
+        if self.pending:
+            logger.info("Replaying %d queued sightings from %s", len(self.pending), self.path)
+
+        # Start from a clean copy, so a line cut short doesn't run into the
+        # next one appended
+        self.rewrite()
+
+    def rewrite(self):
+        # Replace the journal with the header and the entries still pending.
+        # The new file is written alongside and renamed over the old one, so
+        # a crash leaves one or the other
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"journal": self.journal, "flushed": self.flushed}) + "\n")
+            for sequence, row in self.pending:
+                f.write(json.dumps({"sequence": sequence, "row": row}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    def next_sequence(self):
+        return (self.pending[-1][0] if self.pending else self.flushed) + 1
+
+    def add(self, station, train_class, train_number, special_livery, rare, driver_interaction, seen_at=None):
+        # Queue a sighting, timestamped when it was seen rather than saved
+        row = (
+            int(seen_at if seen_at is not None else time.time()),
+            station, train_class, train_number,
+            bool(special_livery), bool(rare), bool(driver_interaction),
+        )
+        sequence = self.next_sequence()
+        self.file.write(json.dumps({"sequence": sequence, "row": row}) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending.append((sequence, row))
+        return sequence
+
+    def batch(self):
+        # The entries to save next. Sightings queued while the batch is
+        # being saved stay pending for the one after
+        return list(self.pending)
+
+    def write(self, db, batch):
+        # Save a batch to the database. May run on the worker thread; only
+        # reads the batch and the journal name
+        if not batch:
+            return 0, [], []
+        saved = db.journal_sequence(self.journal)
+        rows = [row for sequence, row in batch if sequence > saved]
+        return db.insert_logs(rows, journal=(self.journal, batch[-1][0]))
+
+    def confirm(self, sequence):
+        # Drop the entries up to sequence once they are in the database
+        self.pending = [entry for entry in self.pending if entry[0] > sequence]
+        self.flushed = max(self.flushed, sequence)
+        self.file.close()
+        self.rewrite()
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def flush(self, db):
+        # Save everything pending on the calling thread, e.g. from the CLI
+        batch = self.batch()
+        result = self.write(db, batch)
+        if batch:
+            self.confirm(batch[-1][0])
+        return result
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,508 @@
+"""Schema migrations for tp.db, keyed on PRAGMA user_version.
+
+Each migration brings the database up to its version and sets user_version
+in the same transaction as its last change, so a database is never left
+between two versions. A migration is a function taking the Database.
+Work that touches every sighting is done in batches of BATCH_SIZE rows,
+each committed on its own, by a migration written as a generator that
+yields (done, total) after every batch so the caller can show progress. If an
+upgrade is interrupted, the next run carries on from the last batch or
+starts that migration again.
+
+New databases go through the same migrations as old ones. New migrations
+are appended to MIGRATIONS.
+"""
+import logging
+import sqlite3
+
+from . import achievements
+
+logger = logging.getLogger(__name__)
+
+# Number of sightings copied or added up per transaction
+BATCH_SIZE = 50000
+
+# FullLog as of schema version 1. Class and Number stay TEXT: numbers such as
+# "08" or "0840" keep their leading zeros
+FULL_LOG_COLUMNS = """
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    DateTime INTEGER,
+    StationID INTEGER REFERENCES Station (ID),
+    Class TEXT,
+    Number TEXT,
+    SpecialLivery INTEGER NOT NULL DEFAULT 0,
+    Rare INTEGER NOT NULL DEFAULT 0,
+    DriverInteraction INTEGER NOT NULL DEFAULT 0
+"""
+
+
+def set_version(db, cursor, version):
+    db._execute(cursor, f"PRAGMA user_version = {version}")
+
+
+def max_id(db, cursor, table):
+    return db._execute(cursor, f"SELECT IFNULL(MAX(ID), 0) FROM {table}").fetchone()[0]
+
+
+def create_search_index(db, cursor, table):
+    # Full-text index over the station, class and number of every sighting,
+    # kept in step with the log by triggers. It stores no copy of the text
+    # (content='Sightings') and keeps extra prefix indexes so "Crewe*" or
+    # "43*" don't have to walk the term list. Returns False on SQLite builds
+    # without FTS5, which fall back to LIKE searches
+    try:
+        db._execute(cursor, """
+            CREATE VIRTUAL TABLE FullLogSearch USING fts5(
+                Station, Class, Number,
+                content = 'Sightings', content_rowid = 'ID',
+                prefix = '1 2 3'
+            )
+        """)
+    except sqlite3.OperationalError:
+        logger.warning("SQLite has no FTS5 support; text search will use LIKE")
+        return False
+
+    db._execute(cursor, f"""
+        CREATE TRIGGER FullLogSearch_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO FullLogSearch (rowid, Station, Class, Number)
+            VALUES (new.ID, (SELECT Name FROM Station WHERE ID = new.StationID), new.Class, new.Number);
+        END
+    """)
+    db._execute(cursor, f"""
+        CREATE TRIGGER FullLogSearch_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO FullLogSearch (FullLogSearch, rowid, Station, Class, Number)
+            VALUES ('delete', old.ID, (SELECT Name FROM Station WHERE ID = old.StationID), old.Class, old.Number);
+        END
+    """)
+    db._execute(cursor, f"""
+        CREATE TRIGGER FullLogSearch_update AFTER UPDATE OF StationID, Class, Number ON {table} BEGIN
+            INSERT INTO FullLogSearch (FullLogSearch, rowid, Station, Class, Number)
+            VALUES ('delete', old.ID, (SELECT Name FROM Station WHERE ID = old.StationID), old.Class, old.Number);
+            INSERT INTO FullLogSearch (rowid, Station, Class, Number)
+            VALUES (new.ID, (SELECT Name FROM Station WHERE ID = new.StationID), new.Class, new.Number);
+        END
+    """)
+    return True
+
+
+def typed_log(db):
+    # Version 1: flags as INTEGER 0/1, DateTime as a Unix timestamp and
+    # stations in their own table. An unversioned database also gets the
+    # fixes that create_tables used to apply on every start
+    with db.transaction() as cursor:
+        legacy = db._schema_has(cursor, "table", "FullLog")
+
+        # Each station name is stored once and referred to by its ID
+        db._execute(cursor, """
+            CREATE TABLE IF NOT EXISTS Station (
+                ID INTEGER PRIMARY KEY,
+                Name TEXT NOT NULL UNIQUE
+            )
+        """)
+
+        db._execute(cursor, """
+            CREATE TABLE IF NOT EXISTS Basic (
+                ID INTEGER PRIMARY KEY AUTOINCREMENT,
+                Class TEXT,
+                Number TEXT,
+                Quantity INTEGER
+            )
+        """)
+
+        # Give Basic one row per (Class, Number). Databases written by the
+        # old read-then-write tally may hold duplicates, which are merged
+        # into the oldest row before the unique index can be created
+        if not db._schema_has(cursor, "index", "idx_basic_class_number"):
+            db._execute(cursor, """
+                UPDATE Basic SET Quantity = (
+                    SELECT SUM(Quantity) FROM Basic AS dup
+                    WHERE dup.Class IS Basic.Class AND dup.Number IS Basic.Number
+                )
+                WHERE ID IN (
+                    SELECT MIN(ID) FROM Basic
+                    GROUP BY Class, Number
+                    HAVING COUNT(*) > 1
+                )
+            """)
+            db._execute(cursor, """
+                DELETE FROM Basic
+                WHERE ID NOT IN (SELECT MIN(ID) FROM Basic GROUP BY Class, Number)
+            """)
+            db._execute(cursor, """
+                CREATE UNIQUE INDEX idx_basic_class_number ON Basic (Class, Number)
+            """)
+
+        # Lets the highest tally be read from the end of an index
+        db._execute(cursor, """
+            CREATE INDEX IF NOT EXISTS idx_basic_quantity ON Basic (Quantity)
+        """)
+
+        db._execute(cursor, """
+            CREATE TABLE IF NOT EXISTS Total (
+                ID INTEGER PRIMARY KEY,
+                SpecialLivery INTEGER,
+                Rare INTEGER,
+                DriverInteraction INTEGER,
+                Trains INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+
+        # Total gained the Trains count later; older databases get the
+        # column added and filled in once
+        columns = [row[1] for row in db._execute(cursor, "PRAGMA table_info(Total)").fetchall()]
+        if "Trains" not in columns:
+            db._execute(cursor, "ALTER TABLE Total ADD COLUMN Trains INTEGER NOT NULL DEFAULT 0")
+            db._execute(cursor, "UPDATE Total SET Trains = (SELECT COUNT(*) FROM FullLog)")
+
+        db._execute(cursor, """
+            INSERT OR IGNORE INTO Total (ID, SpecialLivery, Rare, DriverInteraction, Trains)
+            VALUES (1, 0, 0, 0, 0)
+        """)
+
+        # The typed log is filled in next to the old one. A run that was
+        # interrupted already has it, with its search index and triggers
+        if not db._schema_has(cursor, "table", "FullLogTyped"):
+            db._execute(cursor, "DROP TRIGGER IF EXISTS FullLogSearch_insert")
+            db._execute(cursor, "DROP TRIGGER IF EXISTS FullLogSearch_delete")
+            db._execute(cursor, "DROP TRIGGER IF EXISTS FullLogSearch_update")
+            db._execute(cursor, "DROP TABLE IF EXISTS FullLogSearch")
+            db._execute(cursor, f"CREATE TABLE FullLogTyped ({FULL_LOG_COLUMNS})")
+            create_search_index(db, cursor, "FullLogTyped")
+
+        copied = max_id(db, cursor, "FullLogTyped")
+        total = max_id(db, cursor, "FullLog") if legacy else 0
+
+    # Copy the old log across a batch of IDs at a time, keeping the IDs so
+    # UnlockedAchievements.FullLogID still points at the same sightings.
+    # DateTime was never filled in by the app, but imported logs may hold
+    # Unix timestamps or ISO dates. An ISO date without a time zone is taken
+    # as local time, as the importer takes it ('utc' converts from local
+    # time, and leaves a date with a time zone alone). The search triggers
+    # index each batch
+    while copied < total:
+        last = min(copied + BATCH_SIZE, total)
+        with db.transaction() as cursor:
+            db._execute(cursor, """
+                INSERT OR IGNORE INTO Station (Name)
+                SELECT DISTINCT Station FROM FullLog
+                WHERE ID > ? AND ID <= ? AND Station != ''
+            """, (copied, last))
+            db._execute(cursor, """
+                INSERT INTO FullLogTyped (ID, DateTime, StationID, Class, Number, SpecialLivery, Rare, DriverInteraction)
+                SELECT FullLog.ID,
+                       CASE
+                           WHEN FullLog.DateTime GLOB '[0-9]*' AND FullLog.DateTime NOT GLOB '*[^0-9]*'
+                           THEN CAST(FullLog.DateTime AS INTEGER)
+                           ELSE CAST(strftime('%s', FullLog.DateTime, 'utc') AS INTEGER)
+                       END,
+                       Station.ID, FullLog.Class, FullLog.Number,
+                       FullLog.SpecialLivery = 'Yes', FullLog.Rare = 'Yes', FullLog.DriverInteraction = 'Yes'
+                FROM FullLog LEFT JOIN Station ON Station.Name = FullLog.Station
+                WHERE FullLog.ID > ? AND FullLog.ID <= ?
+            """, (copied, last))
+        copied = last
+        yield copied, total
+
+    with db.transaction() as cursor:
+        # Keep the AUTOINCREMENT high-water mark, so IDs of deleted
+        # sightings are still never reused. Dropping the old log takes its
+        # indexes with it
+        sequence = None
+        if legacy:
+            sequence = db._execute(cursor, "SELECT seq FROM sqlite_sequence WHERE name = 'FullLog'").fetchone()
+            db._execute(cursor, "DROP TABLE FullLog")
+        db._execute(cursor, "ALTER TABLE FullLogTyped RENAME TO FullLog")
+        if sequence is not None:
+            db._execute(cursor, """
+                UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'FullLog'
+            """, sequence)
+
+        # Indexes for the Search and Statistics filters. Searches always
+        # filter on Class and DriverInteraction; the flag counts and the
+        # flag searches only ever look for flags that are set, which is a
+        # small share of the log, so those get partial indexes
+        db._execute(cursor, """
+            CREATE INDEX idx_fulllog_class_interaction
+            ON FullLog (Class, DriverInteraction)
+        """)
+        for column in ("SpecialLivery", "Rare", "DriverInteraction"):
+            db._execute(cursor, f"""
+                CREATE INDEX idx_fulllog_{column.lower()}
+                ON FullLog (Class) WHERE {column} = 1
+            """)
+
+        # FullLog as it is shown and exported, with the station name
+        db._execute(cursor, """
+            CREATE VIEW IF NOT EXISTS Sightings AS
+            SELECT FullLog.ID AS ID, FullLog.DateTime AS DateTime, Station.Name AS Station,
+                   FullLog.Class AS Class, FullLog.Number AS Number,
+                   FullLog.SpecialLivery AS SpecialLivery, FullLog.Rare AS Rare,
+                   FullLog.DriverInteraction AS DriverInteraction
+            FROM FullLog LEFT JOIN Station ON Station.ID = FullLog.StationID
+        """)
+
+        # Achievements are recorded as they are unlocked. UnlockedAt is a
+        # Unix timestamp and FullLogID the sighting that unlocked it; both
+        # are NULL for achievements earned before unlocks were recorded
+        backfill = not db._schema_has(cursor, "table", "UnlockedAchievements")
+        db._execute(cursor, """
+            CREATE TABLE IF NOT EXISTS UnlockedAchievements (
+                ID INTEGER PRIMARY KEY AUTOINCREMENT,
+                Category TEXT NOT NULL,
+                Threshold INTEGER NOT NULL,
+                Title TEXT NOT NULL,
+                UnlockedAt INTEGER,
+                FullLogID INTEGER,
+                UNIQUE (Category, Threshold)
+            )
+        """)
+        if backfill:
+            db._record_unlocks(cursor, achievements.crossed({}, db._achievement_snapshot(cursor)))
+
+        set_version(db, cursor, 1)
+
+    # The copied log leaves the old pages free; VACUUM hands them back so
+    # the file actually shrinks
+    if total:
+        with db.lock:
+            db.conn.execute("VACUUM")
+        yield total, total
+
+
+def rollups(db):
+    # Version 2: sighting and flag counts per day and per month, class and
+    # station, kept up to date on every insert. The period statistics sum a
+    # handful of these rows, however long the log is. Days and months are in
+    # local time; sightings without a DateTime aren't counted, and
+    # StationID 0 stands for no station. An interrupted run adds them up
+    # again from the start
+    with db.transaction() as cursor:
+        for table, column in (("DailyRollup", "Day"), ("MonthlyRollup", "Month")):
+            db._execute(cursor, f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    {column} TEXT NOT NULL,
+                    Class TEXT NOT NULL,
+                    StationID INTEGER NOT NULL,
+                    Sightings INTEGER NOT NULL,
+                    SpecialLivery INTEGER NOT NULL,
+                    Rare INTEGER NOT NULL,
+                    DriverInteraction INTEGER NOT NULL,
+                    PRIMARY KEY ({column}, Class, StationID)
+                ) WITHOUT ROWID
+            """)
+            db._execute(cursor, f"DELETE FROM {table}")
+        total = max_id(db, cursor, "FullLog")
+
+    done = 0
+    while done < total:
+        last = min(done + BATCH_SIZE, total)
+        with db.transaction() as cursor:
+            db._roll_up(cursor, done + 1, last)
+        done = last
+        yield done, total
+
+    with db.transaction() as cursor:
+        # Sightings for "what did I see last month" are found through
+        # DateTime
+        db._execute(cursor, """
+            CREATE INDEX IF NOT EXISTS idx_fulllog_datetime ON FullLog (DateTime)
+        """)
+        set_version(db, cursor, 2)
+
+
+def journal_marks(db):
+    # Version 3: the last sequence number of each rapid-entry journal whose
+    # sightings have been written to FullLog, so a journal replayed after a
+    # crash doesn't log them twice
+    with db.transaction() as cursor:
+        db._execute(cursor, """
+            CREATE TABLE IF NOT EXISTS JournalMarks (
+                Journal TEXT PRIMARY KEY,
+                Sequence INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        set_version(db, cursor, 3)
+
+
+def search_indexes(db):
+    # Version 4: indexes for the query builder. A search that takes either
+    # value of DriverInteraction reads one class from idx_fulllog_class,
+    # already in ID order, and looking up one station or unit reads its own
+    # sightings rather than the whole log
+    with db.transaction() as cursor:
+        db._execute(cursor, """
+            CREATE INDEX IF NOT EXISTS idx_fulllog_class ON FullLog (Class)
+        """)
+        db._execute(cursor, """
+            CREATE INDEX IF NOT EXISTS idx_fulllog_station ON FullLog (StationID)
+        """)
+        db._execute(cursor, """
+            CREATE INDEX IF NOT EXISTS idx_fulllog_number ON FullLog (Number)
+        """)
+        set_version(db, cursor, 4)
+
+
+def leaderboards(db):
+    # Version 5: running totals per station, class and day for the
+    # leaderboards, kept up to date on every insert. Each has a descending
+    # index on the count it is ranked by, so the top N is the first N
+    # entries of that index. ClassStats.Units counts the distinct units of
+    # a class, one per row of Basic. The class and day totals are added up
+    # from Basic and the rollups, and the station totals from the log a
+    # batch at a time. An interrupted run adds them up again from the start
+    with db.transaction() as cursor:
+        db._execute(cursor, """
+            CREATE TABLE IF NOT EXISTS StationStats (
+                StationID INTEGER PRIMARY KEY REFERENCES Station (ID),
+                Sightings INTEGER NOT NULL
+            )
+        """)
+        db._execute(cursor, """
+            CREATE TABLE IF NOT EXISTS ClassStats (
+                Class TEXT PRIMARY KEY,
+                Sightings INTEGER NOT NULL,
+                Units INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        db._execute(cursor, """
+            CREATE TABLE IF NOT EXISTS DayStats (
+                Day TEXT PRIMARY KEY,
+                Sightings INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        for table, column in (("StationStats", "Sightings"), ("ClassStats", "Units"), ("DayStats", "Sightings")):
+            db._execute(cursor, f"""
+                CREATE INDEX IF NOT EXISTS idx_{table.lower()}_{column.lower()} ON {table} ({column} DESC)
+            """)
+            db._execute(cursor, f"DELETE FROM {table}")
+        db._execute(cursor, """
+            INSERT INTO ClassStats (Class, Sightings, Units)
+            SELECT Class, SUM(Quantity), COUNT(*) FROM Basic
+            WHERE Class IS NOT NULL
+            GROUP BY Class
+        """)
+        db._execute(cursor, """
+            INSERT INTO DayStats (Day, Sightings)
+            SELECT Day, SUM(Sightings) FROM DailyRollup
+            GROUP BY Day
+        """)
+        total = max_id(db, cursor, "FullLog")
+
+    done = 0
+    while done < total:
+        last = min(done + BATCH_SIZE, total)
+        with db.transaction() as cursor:
+            db._execute(cursor, """
+                INSERT INTO StationStats (StationID, Sightings)
+                SELECT StationID, COUNT(*) FROM FullLog NOT INDEXED
+                WHERE ID BETWEEN ? AND ? AND StationID IS NOT NULL
+                GROUP BY StationID
+                ON CONFLICT (StationID) DO UPDATE SET Sightings = Sightings + excluded.Sightings
+            """, (done + 1, last))
+        done = last
+        yield done, total
+
+    with db.transaction() as cursor:
+        set_version(db, cursor, 5)
+
+
+def breakdowns(db):
+    # Version 6: distinct units and flag counts per station and per class,
+    # for the statistics breakdown. StationUnits tallies each unit at each
+    # station, the way Basic does overall, so StationStats.Units counts its
+    # rows. Sightings without a class or number aren't counted as units. The
+    # breakdown lists classes by sightings, which gets an index like the
+    # station one. The station, class and day totals are added up again from
+    # the log a batch at a time, the way inserts keep them up to date. An
+    # interrupted run adds them up again from the start
+    with db.transaction() as cursor:
+        for table, columns in (("StationStats", ("Units", "SpecialLivery", "Rare", "DriverInteraction")),
+                               ("ClassStats", ("SpecialLivery", "Rare", "DriverInteraction"))):
+            existing = [row[1] for row in db._execute(cursor, f"PRAGMA table_info({table})").fetchall()]
+            for column in columns:
+                if column not in existing:
+                    db._execute(cursor, f"ALTER TABLE {table} ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+        db._execute(cursor, """
+            CREATE TABLE IF NOT EXISTS StationUnits (
+                StationID INTEGER NOT NULL,
+                Class TEXT NOT NULL,
+                Number TEXT NOT NULL,
+                Sightings INTEGER NOT NULL,
+                PRIMARY KEY (StationID, Class, Number)
+            ) WITHOUT ROWID
+        """)
+        db._execute(cursor, """
+            CREATE INDEX IF NOT EXISTS idx_classstats_sightings ON ClassStats (Sightings DESC)
+        """)
+
+        for table in ("StationUnits", "StationStats", "ClassStats", "DayStats"):
+            db._execute(cursor, f"DELETE FROM {table}")
+        total = max_id(db, cursor, "FullLog")
+
+    done = 0
+    while done < total:
+        last = min(done + BATCH_SIZE, total)
+        with db.transaction() as cursor:
+            db._count_leaders(cursor, done + 1, last)
+        done = last
+        yield done, total
+
+    with db.transaction() as cursor:
+        # _count_leaders takes a unit as new to its class when all of its
+        # Basic tally is in the batch, which Basic, already complete, only
+        # bears out for units seen in a single batch. The units of each
+        # class are counted from Basic instead
+        db._execute(cursor, """
+            UPDATE ClassStats SET Units = (SELECT COUNT(*) FROM Basic WHERE Basic.Class = ClassStats.Class)
+        """)
+        set_version(db, cursor, 6)
+
+
+def roster(db):
+    # Version 7: the fleet roster, for class completion. Roster holds each
+    # unit of a class with its Position in the class, and RosterClass a
+    # bitmap per class with bit Position set once that unit has been seen,
+    # the number of units and how many of them have been seen. RosterSource
+    # records when the roster file was last loaded. The roster starts
+    # empty; see trainspotter.roster
+    with db.transaction() as cursor:
+        db._execute(cursor, """
+            CREATE TABLE IF NOT EXISTS Roster (
+                Class TEXT NOT NULL,
+                Number TEXT NOT NULL,
+                Position INTEGER NOT NULL,
+                PRIMARY KEY (Class, Number)
+            ) WITHOUT ROWID
+        """)
+        db._execute(cursor, """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_roster_position ON Roster (Class, Position)
+        """)
+        db._execute(cursor, """
+            CREATE TABLE IF NOT EXISTS RosterClass (
+                Class TEXT PRIMARY KEY,
+                Units INTEGER NOT NULL,
+                Seen INTEGER NOT NULL,
+                Bitmap BLOB NOT NULL
+            ) WITHOUT ROWID
+        """)
+        db._execute(cursor, """
+            CREATE TABLE IF NOT EXISTS RosterSource (
+                Path TEXT PRIMARY KEY,
+                Modified INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        set_version(db, cursor, 7)
+
+
+# (version, description, migration) in the order they are applied
+MIGRATIONS = (
+    (1, "Converting the log to compact storage", typed_log),
+    (2, "Adding up daily and monthly totals", rollups),
+    (3, "Adding the rapid-entry journal marks", journal_marks),
+    (4, "Indexing classes, stations and unit numbers", search_indexes),
+    (5, "Adding up the leaderboards", leaderboards),
+    (6, "Adding up units and flags per station and class", breakdowns),
+    (7, "Adding the fleet roster", roster),
+)
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
@@ -0,0 +1,173 @@
+"""Composable queries over the sightings.
+
+A SightingQuery gathers filters one call at a time and builds a single
+SELECT over the Sightings view from them. Only the filters that are asked
+for make it into the SQL: a flag left as None ("any") adds no condition at
+all, several classes become one Class IN (...), and flag values are written
+into the SQL as literals rather than bound, so the planner can match them
+against the partial indexes on FullLog.
+
+    query = SightingQuery().classes("66", "70").flag("Rare", True).since(start)
+    sql, params = query.order("newest").page(before).build(limit=200)
+
+Pages are keyed on the sort columns of the last row seen rather than an
+OFFSET, as elsewhere.
+"""
+import copy
+
+# Columns of a search result, as the results screen and CLI expect them
+RESULT_COLUMNS = ("Station", "Class", "Number", "SpecialLivery", "Rare", "DriverInteraction", "ID")
+
+# Every column of the Sightings view
+SIGHTING_COLUMNS = ("ID", "DateTime", "Station", "Class", "Number", "SpecialLivery", "Rare", "DriverInteraction")
+
+FLAGS = ("SpecialLivery", "Rare", "DriverInteraction")
+
+# Sort orders: name -> (columns, descending). "oldest" and "newest" are in
+# the order the sightings were logged, "earliest" and "latest" in the order
+# they were seen, which differs for imported logbooks
+ORDERS = {
+    "oldest": (("ID",), False),
+    "newest": (("ID",), True),
+    "earliest": (("DateTime", "ID"), False),
+    "latest": (("DateTime", "ID"), True),
+}
+
+
+def tri_state(value):
+    # True, False or None for "any"
+    return None if value is None else bool(value)
+
+
+def split_classes(text):
+    # "66, 70 158" -> ["66", "70", "158"]
+    return [train_class for train_class in text.replace(",", " ").split() if train_class]
+
+
+def next_prefix(prefix):
+    # The smallest string after every string starting with prefix, so a
+    # prefix match can be written as a range the Number index can answer
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class SightingQuery:
+    def __init__(self, source="Sightings", qualifier=""):
+        # source is what the query reads FROM, and qualifier the prefix of
+        # its Sightings columns when source is a join, e.g. "Sightings."
+        self.source = source
+        self.qualifier = qualifier
+        self.conditions = []
+        self.params = []
+        self.order_columns, self.descending = ORDERS["oldest"]
+        self.id_column = qualifier + "ID"
+
+    def column(self, name):
+        return self.id_column if name == "ID" else self.qualifier + name
+
+    def where(self, condition, *params):
+        # Add any other condition, ANDed with the rest
+        self.conditions.append(condition)
+        self.params.extend(params)
+        return self
+
+    def classes(self, *classes):
+        classes = list(dict.fromkeys(str(train_class).strip() for train_class in classes))
+        classes = [train_class for train_class in classes if train_class]
+        if len(classes) == 1:
+            self.where(self.column("Class") + " = ?", classes[0])
+        elif classes:
+            self.where(f"{self.column('Class')} IN ({', '.join('?' * len(classes))})", *classes)
+        return self
+
+    def station(self, name):
+        if name:
+            self.where(self.column("Station") + " = ?", name.strip())
+        return self
+
+    def number(self, number, prefix=False):
+        number = str(number).strip() if number is not None else ""
+        if not number:
+            return self
+        if prefix:
+            return self.where(f"{self.column('Number')} >= ? AND {self.column('Number')} < ?",
+                              number, next_prefix(number))
+        return self.where(self.column("Number") + " = ?", number)
+
+    def flag(self, column, value):
+        # Only sightings with the flag set (True), not set (False), or
+        # either (None)
+        if column not in FLAGS:
+            raise ValueError(f"Unknown flag: {column}")
+        value = tri_state(value)
+        if value is not None:
+            self.conditions.append(f"{self.column(column)} = {int(value)}")
+        return self
+
+    def flags(self, special_livery=None, rare=None, driver_interaction=None):
+        for column, value in zip(FLAGS, (special_livery, rare, driver_interaction)):
+            self.flag(column, value)
+        return self
+
+    def since(self, start):
+        # Sightings seen at or after start, a Unix timestamp
+        if start is not None:
+            self.where(self.column("DateTime") + " >= ?", start)
+        return self
+
+    def until(self, end):
+        # Sightings seen before end, a Unix timestamp
+        if end is not None:
+            self.where(self.column("DateTime") + " < ?", end)
+        return self
+
+    def order(self, name, id_column=None):
+        # One of ORDERS. id_column stands in for ID in the sort, e.g. the
+        # rowid of a full-text index that hands rows over in that order
+        if name not in ORDERS:
+            raise ValueError(f"Unknown order: {name}")
+        self.order_columns, self.descending = ORDERS[name]
+        if id_column is not None:
+            self.id_column = id_column
+        return self
+
+    def page_key(self, row, columns=RESULT_COLUMNS):
+        # The value to pass to page() for the rows after this one
+        values = tuple(row[columns.index(name)] for name in self.order_columns)
+        return values[0] if len(values) == 1 else values
+
+    def page(self, after):
+        # Only the rows that sort after the last one seen, whose sort column
+        # values are after: an ID, or a (DateTime, ID) pair
+        if after is None:
+            return self
+        columns = [self.column(name) for name in self.order_columns]
+        comparison = "<" if self.descending else ">"
+        if len(columns) == 1:
+            return self.where(f"{columns[0]} {comparison} ?", after)
+        return self.where(f"({', '.join(columns)}) {comparison} ({', '.join('?' * len(columns))})", *after)
+
+    def build(self, columns=RESULT_COLUMNS, limit=None):
+        # The SQL and parameters of the query
+        sql = f"SELECT {', '.join(self.column(name) for name in columns)} FROM {self.source}"
+        params = list(self.params)
+        if self.conditions:
+            sql += " WHERE " + " AND ".join(self.conditions)
+        direction = " DESC" if self.descending else ""
+        sql += " ORDER BY " + ", ".join(self.column(name) + direction for name in self.order_columns)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return sql, tuple(params)
+
+    def copy(self):
+        # A query with the same filters, e.g. to page through without
+        # piling up page conditions
+        query = copy.copy(self)
+        query.conditions = list(self.conditions)
+        query.params = list(self.params)
+        return query
+
+    def key(self):
+        # Everything that decides the results, for caching them
+        return (self.source, tuple(self.conditions), tuple(self.params),
+                self.order_columns, self.descending, self.id_column)
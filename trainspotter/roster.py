@@ -0,0 +1,86 @@
+"""Fleet roster: the unit numbers of each class, for class completion.
+
+The roster is reference data loaded from a CSV file with Class and Number
+columns, one row per unit; any other columns are ignored. No roster ships
+with the app: the user picks a file, from the class breakdown in the app or
+with the roster command, and the app loads it again at startup whenever the
+file has changed. Classes in the file replace what was loaded for them
+before; other classes are left alone.
+
+Each class keeps a bitmap of the units seen, one bit per unit in roster
+order, so checking or recording a unit is one keyed lookup plus a bit test,
+and the completion of a class is a stored count rather than a query.
+
+Usage: python -m trainspotter roster [--load roster.csv] [--class 158 --missing]
+"""
+import csv
+import os
+
+
+def read_roster(path):
+    # {class: sorted unit numbers} from a roster CSV file
+    roster = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        columns = {name.strip().lower(): name for name in reader.fieldnames or () if name}
+        if "class" not in columns or "number" not in columns:
+            raise ValueError(f"{path}: needs Class and Number columns")
+        for record in reader:
+            train_class = (record[columns["class"]] or "").strip()
+            number = (record[columns["number"]] or "").strip()
+            if train_class and number:
+                roster.setdefault(train_class, set()).add(number)
+    return {train_class: sorted(numbers) for train_class, numbers in roster.items()}
+
+
+def load_roster_file(db, path, force=False):
+    # Load a roster file into the database unless it hasn't changed since it
+    # was last loaded, or in any case when force is set. Returns the number
+    # of units loaded, or None if the file is unchanged; a missing file
+    # raises FileNotFoundError. The path is recorded in full, so the file can
+    # be found again from anywhere
+    path = os.path.abspath(path)
+    modified = int(os.path.getmtime(path))
+    if not force and db.roster_source(path) == modified:
+        return None
+    return db.load_roster(read_roster(path), source=(path, modified))
+
+
+def reload_rosters(db):
+    # Load every roster file loaded before again if it has changed since.
+    # Files that have since been moved or deleted are skipped. Returns the
+    # number of units loaded
+    return sum(load_roster_file(db, path) or 0 for path in db.roster_sources() if os.path.exists(path))
+
+
+def new_bitmap(size):
+    return bytearray((size + 7) // 8)
+
+
+def has_bit(bitmap, position):
+    return bool(bitmap[position >> 3] & (1 << (position & 7)))
+
+
+def set_bit(bitmap, position):
+    bitmap[position >> 3] |= 1 << (position & 7)
+
+
+def positions(bitmap, size, seen=True):
+    # The positions whose bit is set, or not set when seen is False
+    return [position for position in range(size) if has_bit(bitmap, position) == seen]
+
+
+def format_progress(seen, units):
+    # "43/57 (75%)"
+    percent = 100 * seen // units if units else 0
+    return f"{seen}/{units} ({percent}%)"
+
+
+def format_completion(train_class, seen, units):
+    # "Class 158: 43/57 (75%)"
+    return f"Class {train_class}: {format_progress(seen, units)}"
+
+
+def describe_cop(train_class, train_number, seen, units):
+    # The notice shown for the first sighting of a unit on the roster
+    return f"New cop {train_class} {train_number} ({seen}/{units} of class {train_class})"
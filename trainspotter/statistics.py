@@ -0,0 +1,88 @@
+"""Presentation of the statistics snapshot, shared by the app and the CLI."""
+from datetime import date
+
+# The periods the statistics can be shown for, with their labels
+PERIOD_LABELS = (
+    ("all", "All Time"),
+    ("today", "Today"),
+    ("week", "Last 7 Days"),
+    ("month", "This Month"),
+    ("year", "This Year"),
+)
+
+# The leaderboards, with their titles, in the order the app shows them
+LEADERBOARD_LABELS = (
+    ("units", "Most Seen Units"),
+    ("stations", "Most Visited Stations"),
+    ("classes", "Most Units per Class"),
+    ("days", "Best Days"),
+)
+
+# The statistics breakdowns, with their labels
+BREAKDOWN_LABELS = (
+    ("station", "By Station"),
+    ("class", "By Class"),
+)
+
+
+def format_train(train):
+    # A (Class, Number, Quantity) row, or None when nothing has been logged
+    if not train:
+        return 'None'
+    return f'{train[0]} {train[1]} ({train[2]} times)'
+
+
+def format_class(train_class):
+    # A (Class, Sightings) row, or None when nothing was logged in the period
+    if not train_class:
+        return 'None'
+    return f'Class {train_class[0]} ({train_class[1]} times)'
+
+
+def describe(statistics):
+    # (label, value) pairs in the order the Statistics screen shows them.
+    # Statistics for a period have the most common class instead of the
+    # most common train
+    if "most_common_class" in statistics:
+        most_common = ('Most Common Class', format_class(statistics["most_common_class"]))
+    else:
+        most_common = ('Most Common Train', format_train(statistics["most_common_train"]))
+    return [
+        ('Total Trains Logged', statistics["total_trains"]),
+        ('Special Livery Trains', statistics["special_livery"]),
+        ('Rare Trains', statistics["rare_trains"]),
+        ('Trains with Driver Interaction', statistics["driver_interaction"]),
+        most_common,
+    ]
+
+
+def format_leader(board, row):
+    # One row of a leaderboard, as Database.leaderboard returns it
+    if board == "units":
+        return format_train(row)
+    if board == "classes":
+        return f'Class {row[0]} ({row[1]} units)'
+    if board == "days":
+        return f'{date.fromisoformat(row[0]).strftime("%d/%m/%Y")} ({row[1]} trains)'
+    return f'{row[0]} ({row[1]} times)'
+
+
+def describe_leaderboard(board, rows):
+    # Numbered lines, highest first
+    if not rows:
+        return ['None']
+    return [f'{place}. {format_leader(board, row)}' for place, row in enumerate(rows, 1)]
+
+
+def describe_breakdown(kind, row):
+    # (label, value) pairs for one station or class, from a row of
+    # Database.fetch_breakdown
+    name, sightings, units, special_livery, rare, driver_interaction = row
+    return [
+        ('Station' if kind == 'station' else 'Class', name),
+        ('Trains Logged', sightings),
+        ('Different Units', units),
+        ('Special Livery Trains', special_livery),
+        ('Rare Trains', rare),
+        ('Trains with Driver Interaction', driver_interaction),
+    ]
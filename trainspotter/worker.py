@@ -0,0 +1,70 @@
+"""Background worker that runs database jobs off the UI thread.
+
+Jobs run one at a time in the order they were submitted, so a search
+submitted after an insert always sees that insert.
+"""
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, func, args, kwargs, callback, error_callback):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.error_callback = error_callback
+        self.cancelled = False
+
+    def cancel(self):
+        # A cancelled job is skipped if it hasn't started yet, and its
+        # callback is dropped if it has
+        self.cancelled = True
+
+    def finish(self, result):
+        if not self.cancelled and self.callback is not None:
+            self.callback(result)
+
+    def fail(self, error):
+        if not self.cancelled and self.error_callback is not None:
+            self.error_callback(error)
+
+
+class Worker:
+    def __init__(self, dispatch=None):
+        # dispatch hands a callable back to the thread that should run the
+        # callbacks; the app passes one that goes through Clock.schedule_once.
+        # Without it, callbacks run on the worker thread
+        self.dispatch = dispatch or (lambda func: func())
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="trainspotter-worker", daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, callback=None, error_callback=None, **kwargs):
+        job = Job(func, args, kwargs, callback, error_callback)
+        self.queue.put(job)
+        return job
+
+    def stop(self):
+        # Let the jobs already queued finish, then end the thread
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            if job.cancelled:
+                continue
+
+            try:
+                result = job.func(*job.args, **job.kwargs)
+            except Exception as error:
+                logger.exception("Background job %r failed", job.func)
+                self.dispatch(lambda job=job, error=error: job.fail(error))
+            else:
+                self.dispatch(lambda job=job, result=result: job.finish(result))